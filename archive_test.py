@@ -0,0 +1,105 @@
+"""
+Check that archiving never loses a live borrowing or penalty, even when 'borrowings' holds a row whose bid is
+already in the archive (which a manual insert can bring in; the bulk importer skips such rows).
+
+The run archives a small synthetic database, checks that the importer skips an open loan reusing an archived bid,
+inserts such a loan directly, archives again, and fails if any borrowing or penalty went missing from both tables.
+
+Usage: python archive_test.py
+"""
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+from datetime import date, timedelta
+
+import bulk_import
+import datagen
+import miniproject
+
+
+def row_counts(cursor):
+    """Return (open loans, borrowings in both tables, penalties in both tables)."""
+    cursor.execute('SELECT COUNT(*) FROM borrowings WHERE end_date IS NULL')
+    open_loans = cursor.fetchone()[0]
+    cursor.execute('SELECT (SELECT COUNT(*) FROM borrowings) + (SELECT COUNT(*) FROM borrowings_archive)')
+    borrowings = cursor.fetchone()[0]
+    cursor.execute('SELECT (SELECT COUNT(*) FROM penalties) + (SELECT COUNT(*) FROM penalties_archive)')
+    penalties = cursor.fetchone()[0]
+    return open_loans, borrowings, penalties
+
+
+def archive(cutoff):
+    with miniproject.pool.writer() as cursor:
+        return miniproject.archive_borrowings(cursor, cutoff)
+
+
+def main():
+    problems = []
+    cutoff = str(date.today() - timedelta(days=miniproject.ARCHIVE_AFTER_DAYS))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'archive.db')
+        datagen.generate(db_path, 2000, 200, 5000)
+
+        miniproject.connect_to_database(db_path, readers=1)
+        moved, _ = archive(cutoff)
+        if not moved:
+            problems.append('the first run archived nothing, the test data is too recent')
+        with miniproject.pool.reader() as cursor:
+            cursor.execute('SELECT bid FROM borrowings_archive ORDER BY bid LIMIT 2')
+            archived_bids = [row[0] for row in cursor.fetchall()]
+            cursor.execute('''
+            SELECT book_id FROM books WHERE book_id NOT IN (SELECT book_id FROM borrowings WHERE end_date IS NULL)
+            ORDER BY book_id LIMIT 2
+            ''')
+            free_books = [row[0] for row in cursor.fetchall()]
+            cursor.execute('SELECT email FROM members LIMIT 1')
+            member = cursor.fetchone()[0]
+        miniproject.close_database()
+
+        # An open loan reusing an archived bid, which the bulk importer must skip
+        import_path = os.path.join(tmp, 'borrowings.jsonl')
+        with open(import_path, 'w') as output:
+            output.write(json.dumps({'bid': archived_bids[0], 'member': member, 'book_id': free_books[0],
+                                     'start_date': str(date.today())}) + '\n')
+        with contextlib.redirect_stdout(io.StringIO()):
+            bulk_import.main(db_path, ['borrowings', import_path])
+
+        # And one inserted directly, which nothing checks
+        miniproject.connect_to_database(db_path, readers=1)
+        with miniproject.pool.reader() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM borrowings WHERE bid = ?', (archived_bids[0],))
+            if cursor.fetchone()[0]:
+                problems.append(f'the importer brought in archived bid {archived_bids[0]}')
+        with miniproject.pool.writer() as cursor, miniproject.immediate_transaction(cursor):
+            cursor.execute('INSERT INTO borrowings (bid, member, book_id, start_date) VALUES (?, ?, ?, ?)',
+                           (archived_bids[1], member, free_books[1], str(date.today())))
+
+        with miniproject.pool.reader() as cursor:
+            before = row_counts(cursor)
+        moved, _ = archive(cutoff)
+        with miniproject.pool.reader() as cursor:
+            after = row_counts(cursor)
+            cursor.execute('SELECT COUNT(*) FROM borrowings WHERE bid = ? AND end_date IS NULL', (archived_bids[1],))
+            if cursor.fetchone()[0] != 1:
+                problems.append(f'the open loan with archived bid {archived_bids[1]} was deleted')
+        miniproject.close_database()
+
+        if moved:
+            problems.append(f'the second run archived {moved} borrowings, expected none')
+        for name, count_before, count_after in zip(('open loans', 'borrowings', 'penalties'), before, after):
+            if count_before != count_after:
+                problems.append(f'{name}: {count_before} before the second run, {count_after} after')
+
+    if problems:
+        for problem in problems:
+            print(f"FAIL: {problem}")
+        sys.exit(1)
+    print("PASS: archiving again lost no borrowing or penalty")
+
+
+if __name__ == '__main__':
+    main()
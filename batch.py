@@ -0,0 +1,196 @@
+"""
+Non-interactive batch mode: replays a stream of member operations at full speed, e.g. a crate of returns at a desk.
+
+Started with: python miniproject.py batch <dbname> [operations.jsonl]   (standard input without a file)
+
+Every line is one JSON operation. Borrows, returns and payments are made for the member of the last successful
+login in the stream:
+    {"op": "login", "email", "password"}
+    {"op": "borrow", "book_id"[, "date"]}
+    {"op": "return", "bid"[, "rating", "review", "date"]}     with a rating, the review is added in the same step
+    {"op": "pay", "pid", "amount"}
+"date" (YYYY-MM-DD, default today) replays a borrow or return as of that day.
+
+The operations run on the pool's writer connection, CHUNK_OPERATIONS lines per transaction, each inside a savepoint
+so that one that fails is rolled back on its own. Once a chunk has committed, one JSON result per line is written
+to standard output in input order, {"line", "op", "ok": true, ...} or {"line", "op", "ok": false, "error"}, and the
+throughput is reported on standard error at the end.
+"""
+import json
+import math
+import os
+import sqlite3
+import sys
+import time
+from collections import Counter
+from datetime import date, datetime
+from itertools import islice
+
+import miniproject
+
+CHUNK_OPERATIONS = int(os.environ.get('LIBRARY_BATCH_CHUNK', 500))  # Lines per transaction
+SQLITE_INT_RANGE = range(-2 ** 63, 2 ** 63)  # Integers SQLite can store; a larger one raises OverflowError
+
+
+class OperationError(Exception):
+    """An operation that cannot be carried out; the message becomes the error of its line."""
+
+
+class Session:
+    """State carried from one line to the next: the logged-in member and what the current chunk changed."""
+
+    def __init__(self):
+        self.email = None
+        self.changed_members = set()
+        self.changed_books = set()
+
+    def member(self):
+        if not self.email:
+            raise OperationError('log in first')
+        return self.email
+
+
+def int_field(operation, name):
+    value = operation.get(name)
+    # JSON true and false arrive as bool, an int subclass
+    if not isinstance(value, int) or isinstance(value, bool) or value not in SQLITE_INT_RANGE:
+        raise OperationError(f'{name} must be an integer')
+    return value
+
+
+def date_field(operation):
+    if 'date' not in operation:
+        return date.today()
+    try:
+        return datetime.strptime(str(operation['date']), '%Y-%m-%d').date()
+    except ValueError:
+        raise OperationError('date must be YYYY-MM-DD')
+
+
+def login(session, cursor, operation):
+    session.email = miniproject.find_member(str(operation.get('email', '')), str(operation.get('password', '')))
+    if not session.email:
+        raise OperationError('invalid email or password')
+    return {'email': session.email}
+
+
+def borrow(session, cursor, operation):
+    book_id = int_field(operation, 'book_id')
+    bid = miniproject.insert_borrowing(cursor, session.member(), book_id, date_field(operation))
+    if bid is None:
+        raise OperationError('book is on borrow or does not exist')
+    session.changed_members.add(session.email)
+    session.changed_books.add(book_id)
+    return {'bid': bid}
+
+
+def return_book(session, cursor, operation):
+    bid = int_field(operation, 'bid')
+    rating = operation.get('rating')
+    if rating is not None and (not isinstance(rating, int) or isinstance(rating, bool) or not 1 <= rating <= 5):
+        raise OperationError('rating must be an integer between 1 and 5')
+    today = date_field(operation)
+
+    returned = miniproject.close_borrowing(cursor, session.member(), bid, today, miniproject.LOAN_PERIOD_DAYS)
+    if returned is None:
+        raise OperationError('no open borrowing with that id')
+    overdue_days, book_id = returned
+    rid = None
+    if rating is not None:
+        rid = miniproject.insert_review(cursor, session.email, book_id, rating, str(operation.get('review', '')),
+                                        today.strftime('%Y-%m-%d'))
+    session.changed_members.add(session.email)
+    session.changed_books.add(book_id)
+    return {'overdue_days': overdue_days, 'rid': rid}
+
+
+def pay(session, cursor, operation):
+    pid = int_field(operation, 'pid')
+    amount = operation.get('amount')
+    # JSON NaN and Infinity are parsed as floats
+    if not isinstance(amount, (int, float)) or isinstance(amount, bool) or not math.isfinite(amount) or amount <= 0:
+        raise OperationError('amount must be a positive number')
+    if not miniproject.apply_payment(cursor, session.member(), pid, amount):
+        raise OperationError('no unpaid penalty with that id, or amount exceeds it')
+    session.changed_members.add(session.email)
+    return {'pid': pid, 'amount': amount}
+
+
+OPERATIONS = {
+    'login': login,
+    'borrow': borrow,
+    'return': return_book,
+    'pay': pay,
+}
+
+
+def run_operation(session, cursor, number, line):
+    """Apply one input line inside a savepoint and return its result."""
+    result = {'line': number, 'op': None}
+    cursor.execute('SAVEPOINT batch_operation')
+    try:
+        operation = json.loads(line)
+        if not isinstance(operation, dict):
+            raise OperationError('line must be a JSON object')
+        op = operation.get('op')
+        result['op'] = op if isinstance(op, str) else None  # Anything else is not an op name, nor hashable
+        handler = OPERATIONS.get(result['op'])
+        if not handler:
+            raise OperationError(f"unknown op, expected one of: {', '.join(OPERATIONS)}")
+        result.update(ok=True, **handler(session, cursor, operation))
+    except (OperationError, ValueError, OverflowError, sqlite3.IntegrityError) as error:
+        # ValueError covers lines that are not valid JSON, OverflowError numbers too large for SQLite
+        cursor.execute('ROLLBACK TO batch_operation')
+        result.update(ok=False, error=str(error))
+    cursor.execute('RELEASE batch_operation')
+    return result
+
+
+def run_chunk(session, lines):
+    """Apply (line number, line) pairs in one transaction and return their results once it has committed."""
+    with miniproject.pool.writer() as cursor, miniproject.immediate_transaction(cursor):
+        results = [run_operation(session, cursor, number, line) for number, line in lines]
+
+    # Only now are the changes visible to other connections, so only now can cached copies be dropped
+    for email in session.changed_members:
+        miniproject.invalidate_member_summary(email)
+    for book_id in session.changed_books:
+        miniproject.invalidate_book_searches(book_id)
+    session.changed_members.clear()
+    session.changed_books.clear()
+    return results
+
+
+def run(source, output, chunk_operations=CHUNK_OPERATIONS):
+    """Replay the operations read from 'source' and write their results to 'output'; returns the outcome counts."""
+    session = Session()
+    outcomes = Counter()
+    lines = ((number, line) for number, line in enumerate(source, start=1) if line.strip())
+    while True:
+        chunk = list(islice(lines, chunk_operations))
+        if not chunk:
+            return outcomes
+        for result in run_chunk(session, chunk):
+            output.write(json.dumps(result) + '\n')
+            outcomes[(result['op'], result['ok'])] += 1
+
+
+def main(db_path, path='-'):
+    miniproject.connect_to_database(db_path, readers=1)  # Only logins read outside the writer connection
+    start = time.perf_counter()
+    try:
+        if path == '-':
+            outcomes = run(sys.stdin, sys.stdout)
+        else:
+            with open(path, encoding='utf-8') as source:
+                outcomes = run(source, sys.stdout)
+    finally:
+        miniproject.close_database()
+    elapsed = time.perf_counter() - start
+
+    total = sum(outcomes.values())
+    failed = sum(count for (_, ok), count in outcomes.items() if not ok)
+    print(f"{total} operations in {elapsed:.2f}s ({total / max(elapsed, 1e-9):.0f} ops/sec), {failed} failed",
+          file=sys.stderr)
+    for op in sorted({op for op, _ in outcomes}, key=str):
+        print(f"  {op}: {outcomes[(op, True)]} ok, {outcomes[(op, False)]} failed", file=sys.stderr)
@@ -0,0 +1,81 @@
+"""
+Benchmark of group commit (write_queue.py) against one commit per write.
+
+A number of threads, each standing for one member session, borrow and return books as fast as they can; every
+borrow and every return is one write. Both runs use synchronous=FULL, so each commit waits for the disk and the
+difference shows how much sharing commits between sessions saves.
+
+Usage: python bench_group_commit.py [seconds per run] [threads]
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import bench_pool
+import miniproject
+from loadgen import percentile
+from write_queue import WriteQueue
+
+
+def run(db_path, threads, seconds, group_commit):
+    """Return (writes/sec, p50 ms, p99 ms, average writes per commit) for one run."""
+    miniproject.connect_to_database(db_path, readers=1)
+    if group_commit:
+        miniproject.write_queue = WriteQueue(miniproject.pool, miniproject.immediate_transaction)
+    else:
+        with miniproject.pool.writer() as cursor:
+            cursor.execute('PRAGMA synchronous=FULL')
+    stop = threading.Event()
+    latencies = [[] for _ in range(threads)]
+
+    def session(index):
+        email = f'member{index}@example.com'
+        today = datetime.now().date()
+        book_id = index + 1  # Each session keeps to its own books so that no borrow is refused
+        while not stop.is_set():
+            start = time.perf_counter()
+            bid = miniproject.borrow_book(email, book_id)
+            middle = time.perf_counter()
+            miniproject.record_return(email, bid, today)
+            latencies[index] += [middle - start, time.perf_counter() - middle]
+            book_id += threads
+            if book_id > bench_pool.BOOKS:
+                book_id = index + 1
+
+    workers = [threading.Thread(target=session, args=(index,)) for index in range(threads)]
+    for worker in workers:
+        worker.start()
+    time.sleep(seconds)
+    stop.set()
+    for worker in workers:
+        worker.join()
+
+    batch_size = miniproject.write_queue.writes / max(miniproject.write_queue.batches, 1) if group_commit else 1
+    miniproject.close_database()
+    all_latencies = [latency for session_latencies in latencies for latency in session_latencies]
+    return (len(all_latencies) / seconds, percentile(all_latencies, 0.5) * 1000, percentile(all_latencies, 0.99) * 1000,
+            batch_size)
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        bench_pool.create_database(db_path)
+        miniproject.connect_to_database(db_path)  # Apply the migrations before timing anything
+        miniproject.close_database()
+
+        print(f"{threads} sessions, {seconds:g}s per run")
+        print(f"{'mode':<14} {'writes/sec':>11} {'p50 ms':>8} {'p99 ms':>8} {'writes/commit':>14}")
+        for name, group_commit in (('per-operation', False), ('group commit', True)):
+            writes_per_second, p50, p99, batch_size = run(db_path, threads, seconds, group_commit)
+            print(f"{name:<14} {writes_per_second:>11.0f} {p50:>8.2f} {p99:>8.2f} {batch_size:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
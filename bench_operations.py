@@ -0,0 +1,273 @@
+"""
+Benchmark of the member-facing operations of miniproject.py: check_credentials, get_member_profile, return_book,
+search_and_borrow_books and pay_penalty.
+
+Each operation is called in a loop for a fixed time, exactly as the menu calls it, with its prompts answered by a
+script instead of the keyboard and its output discarded. Members, books and keywords are picked with the same skew
+as datagen.py, so heavy borrowers and popular books come up as often as they would in use. Any setup an operation
+needs (a loan to return, a penalty to pay) is done outside the timed call.
+
+The results (latency percentiles and calls per second for each operation, plus the database sizes) are printed and
+written as JSON; --compare prints the change against an earlier results file.
+
+The benchmark borrows, returns, reviews and pays, so run it on a generated database (python datagen.py), not a
+real one.
+
+Usage: python bench_operations.py <dbname> [--seconds 5] [--seed 1] [--operations login,profile,...]
+                                            [--output bench_results.json] [--compare old_results.json]
+"""
+import argparse
+import io
+import json
+import platform
+import random
+import re
+import sqlite3
+import sys
+import time
+from contextlib import redirect_stdout
+from datetime import datetime
+from unittest import mock
+
+import datagen
+import miniproject
+from loadgen import percentile
+
+WARMUP_CALLS = 20  # Untimed calls before each operation is measured
+MAX_REPEATED_PROMPTS = 5  # A prompt asked more often than this in one call means the script is stuck in a loop
+PENALTY_SAMPLE = 20000  # Unpaid penalties loaded for the pay_penalty benchmark
+
+
+class ScriptedInput:
+    """
+    Stands in for input(): answers each prompt with the first entry of 'answers' whose key starts the prompt.
+    A list value gives successive answers to the same prompt. 'output' collects what the call printed.
+    """
+
+    def __init__(self):
+        self.answers = {}
+        self.asked = {}
+        self.output = io.StringIO()
+
+    def script(self, answers):
+        self.answers = {prompt: list(answer) if isinstance(answer, list) else answer
+                        for prompt, answer in answers.items()}
+        self.asked = {}
+
+    def __call__(self, prompt=''):
+        for start, answer in self.answers.items():
+            if prompt.startswith(start):
+                self.asked[start] = self.asked.get(start, 0) + 1
+                if self.asked[start] > MAX_REPEATED_PROMPTS:
+                    raise RuntimeError(f'prompt asked repeatedly: {prompt!r}')
+                return (answer.pop(0) if len(answer) > 1 else answer[0]) if isinstance(answer, list) else answer
+        raise RuntimeError(f'no scripted answer for prompt {prompt!r}')
+
+
+class Workload:
+    """The members, books and penalties of the database, and skewed random choices among them."""
+
+    def __init__(self, rng):
+        self.rng = rng
+        with miniproject.pool.reader() as cursor:
+            cursor.execute('SELECT email, passwd FROM members ORDER BY email')
+            self.members = cursor.fetchall()
+            cursor.execute('SELECT IFNULL(MAX(book_id), 0) FROM books')
+            self.books = cursor.fetchone()[0]
+            cursor.execute('SELECT COUNT(*) FROM borrowings')
+            self.borrowings = cursor.fetchone()[0]
+            cursor.execute('''
+            SELECT b.member, p.pid FROM penalties p JOIN borrowings b ON b.bid = p.bid
+            WHERE IFNULL(p.paid_amount, 0) + 1 <= p.amount LIMIT ?
+            ''', (PENALTY_SAMPLE,))
+            self.penalties = cursor.fetchall()
+        if not self.members or not self.books:
+            raise SystemExit('The database has no members or no books: create one with datagen.py first.')
+
+    def member(self):
+        return self.members[datagen.scatter(datagen.skewed(self.rng, len(self.members)), len(self.members))]
+
+    def book_id(self):
+        return datagen.scatter(datagen.skewed(self.rng, self.books), self.books) + 1
+
+    def keyword(self):
+        return datagen.WORDS[datagen.skewed(self.rng, len(datagen.WORDS))]
+
+
+# Each prepare_* function does the untimed setup for one call and returns (call, cleanup); both take no arguments
+# and cleanup may be None. 'console' is the ScriptedInput answering the call's prompts.
+
+def prepare_login(workload, console):
+    email, passwd = workload.member()
+    return lambda: miniproject.check_credentials(email, passwd), None
+
+
+def prepare_profile(workload, console):
+    email, _ = workload.member()
+    return lambda: miniproject.get_member_profile(email), None
+
+
+def prepare_return(workload, console):
+    email, _ = workload.member()
+    bid = None
+    while bid is None:
+        bid = miniproject.borrow_book(email, workload.book_id())
+    review = workload.rng.random() < 0.3
+    console.script({'Enter the Borrowing ID': str(bid), 'Would you like to write a review': 'y' if review else 'n',
+                    'Rating': str(workload.rng.randint(1, 5)), 'Review': 'benchmark review'})
+    return lambda: miniproject.return_book(email), None
+
+
+def prepare_search(workload, console):
+    email, _ = workload.member()
+    console.script({'Enter a keyword': workload.keyword(), 'Show more results': 'no',
+                    'Would you like to borrow': ['yes', 'no'], 'Enter the Book ID': str(workload.book_id())})
+
+    def cleanup():
+        # Return the book again so that repeated runs do not gradually lend out the whole library
+        borrowed = re.search(r'borrowing ID: (\d+)', console.output.getvalue())
+        if borrowed:
+            miniproject.record_return(email, int(borrowed.group(1)), datetime.now().date())
+
+    return lambda: miniproject.search_and_borrow_books(email), cleanup
+
+
+def prepare_pay(workload, console):
+    if not workload.penalties:
+        raise SystemExit('The database has no unpaid penalties to pay.')
+    email, pid = workload.rng.choice(workload.penalties)
+    console.script({'Enter the Penalty ID': str(pid), 'Enter the amount': '0.01'})
+    return lambda: miniproject.pay_penalty(email), None
+
+
+OPERATIONS = {
+    'login': prepare_login,  # check_credentials
+    'profile': prepare_profile,  # get_member_profile
+    'return': prepare_return,  # return_book, with a review 30% of the time
+    'search': prepare_search,  # search_and_borrow_books, first page only, then borrowing one book
+    'pay': prepare_pay,  # pay_penalty, paying one cent
+}
+
+
+def measure(prepare, workload, console, seconds):
+    """Call one operation repeatedly for 'seconds' of timed calls; return the list of latencies and the error count."""
+    latencies = []
+    errors = 0
+    timed = 0.0
+    calls = 0
+    while timed < seconds:
+        call, cleanup = prepare(workload, console)
+        console.output = io.StringIO()
+        with redirect_stdout(console.output):
+            start = time.perf_counter()
+            try:
+                call()
+                failed = False
+            except (RuntimeError, sqlite3.Error):
+                failed = True
+            elapsed = time.perf_counter() - start
+        if cleanup:
+            cleanup()
+
+        calls += 1
+        if calls <= WARMUP_CALLS:
+            continue
+        timed += elapsed
+        if failed:
+            errors += 1
+        else:
+            latencies.append(elapsed)
+    return latencies, errors
+
+
+def summarize(latencies, errors):
+    if not latencies:
+        return {'calls': 0, 'errors': errors}
+    total = sum(latencies)
+    return {
+        'calls': len(latencies),
+        'errors': errors,
+        'calls_per_sec': round(len(latencies) / total, 1),
+        'mean_ms': round(total / len(latencies) * 1000, 3),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 3),
+        'p90_ms': round(percentile(latencies, 0.9) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'max_ms': round(max(latencies) * 1000, 3),
+    }
+
+
+def print_results(results, baseline=None):
+    print(f"{'operation':<10} {'calls':>7} {'calls/sec':>10} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for name, stats in results['operations'].items():
+        if not stats['calls']:
+            print(f"{name:<10} {0:>7} {'-':>10} {'-':>8} {'-':>8} {'-':>8} {stats['errors']:>7}")
+            continue
+        line = (f"{name:<10} {stats['calls']:>7} {stats['calls_per_sec']:>10.1f} {stats['p50_ms']:>8.2f} "
+                f"{stats['p90_ms']:>8.2f} {stats['p99_ms']:>8.2f} {stats['errors']:>7}")
+        old = (baseline or {}).get('operations', {}).get(name)
+        if old and old.get('calls'):
+            # Positive is slower than the baseline
+            line += (f"   p50 {change(old['p50_ms'], stats['p50_ms']):>7}"
+                     f"  p99 {change(old['p99_ms'], stats['p99_ms']):>7}")
+        print(line)
+
+
+def change(old, new):
+    return f"{(new - old) / old * 100:+.1f}%" if old else '-'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the member-facing operations.')
+    parser.add_argument('db_path')
+    parser.add_argument('--seconds', type=float, default=5, help='timed seconds per operation')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--operations', default=','.join(OPERATIONS), help='comma-separated subset of: ' + ', '.join(OPERATIONS))
+    parser.add_argument('--output', default='bench_results.json', help='where to write the results as JSON')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    args = parser.parse_args()
+
+    names = args.operations.split(',')
+    unknown = [name for name in names if name not in OPERATIONS]
+    if unknown:
+        parser.error(f'unknown operations: {", ".join(unknown)}')
+
+    miniproject.connect_to_database(args.db_path)
+    workload = Workload(random.Random(args.seed))
+    console = ScriptedInput()
+    results = {
+        'database': args.db_path,
+        'members': len(workload.members),
+        'books': workload.books,
+        'borrowings': workload.borrowings,
+        'seed': args.seed,
+        'seconds': args.seconds,
+        'started': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'operations': {},
+    }
+    with mock.patch('builtins.input', console):
+        for name in names:
+            latencies, errors = measure(OPERATIONS[name], workload, console, args.seconds)
+            results['operations'][name] = summarize(latencies, errors)
+    if miniproject.search_cache:
+        results['search_cache'] = miniproject.search_cache.stats()
+    miniproject.close_database()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as old:
+            baseline = json.load(old)
+    print(f"{args.db_path}: {results['books']} books, {results['members']} members, {results['borrowings']} borrowings")
+    print_results(results, baseline)
+    if 'search_cache' in results:
+        print(f"Search cache: {results['search_cache']}")
+    with open(args.output, 'w') as output:
+        json.dump(results, output, indent=2)
+    print(f"Results written to {args.output}")
+    if any(stats['errors'] for stats in results['operations'].values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Benchmark of the connection pool: read throughput as reader threads are added, while one thread keeps writing.
+
+Each reader thread loops over member profiles and keyword searches; the writer thread borrows and returns books
+the whole time. With WAL mode the readers are not blocked by the writer, so reads per second should grow with
+the number of reader threads until the CPU runs out.
+
+Usage: python bench_pool.py [seconds per run] [max reader threads]
+"""
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import miniproject
+
+BOOKS = 20000
+MEMBERS = 2000
+LOANS = 60000
+PENALTIES = 5000
+WORDS = ['the', 'history', 'of', 'river', 'stone', 'night', 'garden', 'winter', 'king', 'ocean', 'city', 'song']
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.sql')
+
+
+def create_database(db_path):
+    """Fill a new database with random books, members, closed loans and unpaid penalties."""
+    rng = random.Random(1)
+    connection = sqlite3.connect(db_path)
+    with open(SCHEMA_PATH) as schema:
+        connection.executescript(schema.read())
+    connection.executemany('INSERT INTO members (email, passwd, name) VALUES (?, ?, ?)',
+                           [(f'member{i}@example.com', 'pwd', f'member {i}') for i in range(MEMBERS)])
+    connection.executemany('INSERT INTO books (book_id, title, author, pyear) VALUES (?, ?, ?, ?)',
+                           [(i, ' '.join(rng.choice(WORDS) for _ in range(3)), f'author {rng.randrange(1000)}', 2000)
+                            for i in range(1, BOOKS + 1)])
+    connection.executemany('INSERT INTO borrowings (member, book_id, start_date, end_date) VALUES (?, ?, ?, ?)',
+                           [(f'member{rng.randrange(MEMBERS)}@example.com', rng.randint(1, BOOKS), '2024-01-01', '2024-01-15')
+                            for _ in range(LOANS)])
+    connection.executemany('INSERT INTO penalties (bid, amount, paid_amount) VALUES (?, ?, ?)',
+                           [(rng.randint(1, LOANS), rng.randint(1, 30), 0) for _ in range(PENALTIES)])
+    connection.commit()
+    connection.close()
+
+
+def run(db_path, readers, seconds):
+    """Run 'readers' reading threads and one writing thread for 'seconds'; return (reads/sec, writes/sec)."""
+    miniproject.connect_to_database(db_path, readers)
+    stop = threading.Event()
+    reads = [0] * readers
+    writes = [0]
+
+    def read_loop(index):
+        rng = random.Random(index)
+        while not stop.is_set():
+            if rng.random() < 0.5:
+                miniproject.get_member_summary(f'member{rng.randrange(MEMBERS)}@example.com')
+            else:
+                miniproject.search_books_page(rng.choice(WORDS))
+            reads[index] += 1
+
+    def write_loop():
+        rng = random.Random(-1)
+        today = datetime.now().date()
+        while not stop.is_set():
+            email = f'member{rng.randrange(MEMBERS)}@example.com'
+            bid = miniproject.borrow_book(email, rng.randint(1, BOOKS))
+            if bid is not None:
+                miniproject.record_return(email, bid, today)
+                writes[0] += 2
+
+    threads = [threading.Thread(target=read_loop, args=(index,)) for index in range(readers)]
+    threads.append(threading.Thread(target=write_loop))
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    miniproject.close_database()
+    return sum(reads) / seconds, writes[0] / seconds
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 3
+    max_readers = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        create_database(db_path)
+        miniproject.connect_to_database(db_path)  # Apply the migrations before timing anything
+        miniproject.close_database()
+
+        print(f"{'readers':>8} {'reads/sec':>12} {'writes/sec':>12}")
+        readers = 1
+        while readers <= max_readers:
+            reads_per_second, writes_per_second = run(db_path, readers, seconds)
+            print(f"{readers:>8} {reads_per_second:>12.0f} {writes_per_second:>12.0f}")
+            readers *= 2
+
+
+if __name__ == '__main__':
+    main()
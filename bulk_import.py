@@ -0,0 +1,200 @@
+"""
+Bulk import of books, members, borrowings, reviews and penalties from CSV or JSONL files.
+
+Started with: python miniproject.py import <dbname> <table> <file> [<table> <file> ...]
+
+CSV files need a header row naming the table's columns; JSONL files hold one JSON object per line. Columns that
+are missing are stored as NULL and unknown ones are ignored. Files are read as a stream and inserted in chunks with
+executemany, committing every TRANSACTION_ROWS rows, so memory use does not depend on the file size.
+
+While the import runs, the secondary indexes and triggers are dropped and foreign keys are not enforced. At the
+end the indexes and triggers are recreated, the search and word indexes and book_stats are rebuilt in one pass, and
+the foreign keys of the imported tables are checked. The dropped definitions are kept in the database until then, so
+an import that is interrupted has them recreated and the rebuilds done the next time the database is opened.
+Members are checked with the same email and name rules as register(), and rows that fail are skipped and reported.
+"""
+import csv
+import json
+import sys
+import time
+from contextlib import contextmanager
+from itertools import islice
+
+import miniproject
+
+CHUNK_ROWS = 10000  # Rows per executemany call
+TRANSACTION_ROWS = 500000  # Rows per commit
+
+TABLE_COLUMNS = {
+    'books': ('book_id', 'title', 'author', 'pyear'),
+    'members': ('email', 'passwd', 'name', 'byear', 'faculty'),
+    'borrowings': ('bid', 'member', 'book_id', 'start_date', 'end_date'),
+    'reviews': ('rid', 'book_id', 'member', 'rating', 'rtext', 'rdate'),
+    'penalties': ('pid', 'bid', 'amount', 'paid_amount'),
+}
+
+# NOT NULL columns: rows missing one are rejected up front, as INSERT OR IGNORE would skip them like duplicates
+REQUIRED_COLUMNS = {
+    'borrowings': ('member', 'book_id'),
+    'reviews': ('book_id', 'member'),
+    'penalties': ('bid',),
+}
+
+# Id column and archive table of the tables archive_borrowings() moves rows out of: an id already archived counts as
+# a duplicate, since a live row reusing it would clash with the archived one
+ARCHIVED_IDS = {
+    'borrowings': ('bid', 'borrowings_archive'),
+    'penalties': ('pid', 'penalties_archive'),
+}
+
+
+def read_rows(path, columns):
+    """Yield one tuple per record of a CSV or JSONL file, with the values in the order of 'columns'."""
+    with open(path, newline='', encoding='utf-8') as source:
+        if path.endswith('.csv'):
+            for record in csv.DictReader(source):
+                # CSV has no NULL, an empty field stands for one
+                yield tuple(record.get(column) or None for column in columns)
+        else:
+            for line in source:
+                if line.strip():
+                    record = json.loads(line)
+                    yield tuple(record.get(column) for column in columns)
+
+
+def chunks(rows, size):
+    """Group an iterator of rows into lists of at most 'size' rows."""
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def validate_members(chunk):
+    """
+    Apply register()'s rules to a chunk of member rows: the email must match EMAIL_PATTERN, the name (stripped and
+    lowercased like register() does) must match NAME_PATTERN and the password must not be empty.
+    Returns the cleaned valid rows and the number of rejected rows.
+    """
+    emails = [str(row[0] or '').strip() for row in chunk]
+    passwords = [str(row[1] or '').strip() for row in chunk]
+    names = [str(row[2] or '').strip().lower() for row in chunk]
+    faculties = [str(row[4] or '').strip().lower() or None for row in chunk]
+    good_emails = map(miniproject.EMAIL_PATTERN.fullmatch, emails)
+    good_names = map(miniproject.NAME_PATTERN.fullmatch, names)
+
+    valid = [(email, password, name, row[3], faculty)
+             for row, email, password, name, faculty, good_email, good_name
+             in zip(chunk, emails, passwords, names, faculties, good_emails, good_names)
+             if good_email and good_name and password]
+    return valid, len(chunk) - len(valid)
+
+
+@contextmanager
+def deferred_maintenance(cursor):
+    """
+    Drop the secondary indexes and all triggers for the duration of the import and recreate them afterwards,
+    followed by the rebuilds the triggers would otherwise have done row by row.
+    """
+    cursor.execute("""
+    SELECT type, name, sql FROM sqlite_master
+    WHERE type IN ('index', 'trigger') AND sql IS NOT NULL AND tbl_name IN ('books', 'members', 'borrowings', 'reviews', 'penalties')
+    """)
+    saved = cursor.fetchall()
+    # Record the definitions in the same transaction as the drops: if the import is killed or the machine crashes,
+    # the next connection recreates them (see miniproject.restore_deferred_objects())
+    with miniproject.immediate_transaction(cursor):
+        cursor.executemany('INSERT OR REPLACE INTO deferred_objects (type, name, sql) VALUES (?, ?, ?)', saved)
+        for object_type, name, _ in saved:
+            cursor.execute(f'DROP {object_type.upper()} "{name}"')
+    cursor.execute('PRAGMA foreign_keys=OFF')
+    # Skip the fsyncs: a killed import loses nothing that was committed, but an OS crash or power loss while it runs
+    # can damage the database file, so back up a database that holds data before importing into it
+    cursor.execute('PRAGMA synchronous=OFF')
+    try:
+        yield
+    finally:
+        cursor.connection.commit()
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        start = time.perf_counter()
+        miniproject.restore_deferred_objects(cursor)
+        cursor.execute('ANALYZE')
+        cursor.connection.commit()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        print(f"Rebuilt indexes, triggers, search and word indexes and book statistics in {time.perf_counter() - start:.1f}s")
+
+
+def drop_archived(cursor, table, chunk):
+    """Remove the rows whose id is already in the table's archive; returns the remaining rows."""
+    id_column, archive = ARCHIVED_IDS[table]
+    position = TABLE_COLUMNS[table].index(id_column)
+    ids = [row[position] for row in chunk if row[position] is not None]
+    cursor.execute(f'SELECT {id_column} FROM {archive} WHERE {id_column} IN (SELECT value FROM json_each(?))',
+                   (json.dumps(ids),))
+    archived = {str(row[0]) for row in cursor.fetchall()}  # CSV ids are strings
+    return [row for row in chunk if row[position] is None or str(row[position]) not in archived]
+
+
+def import_file(cursor, table, path):
+    """
+    Stream one file into a table. Returns (rows inserted, rows rejected, duplicate rows skipped); a duplicate is a
+    row whose key is already in the table, or whose id is in its archive.
+    """
+    columns = TABLE_COLUMNS[table]
+    insert = f'INSERT OR IGNORE INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})'
+    required = [columns.index(column) for column in REQUIRED_COLUMNS.get(table, ())]
+    inserted = rejected = duplicates = 0
+    since_commit = 0
+
+    for chunk in chunks(read_rows(path, columns), CHUNK_ROWS):
+        if table == 'members':
+            chunk, invalid = validate_members(chunk)
+            rejected += invalid
+        if required:
+            complete = [row for row in chunk if all(row[position] is not None for position in required)]
+            rejected += len(chunk) - len(complete)
+            chunk = complete
+        if table in ARCHIVED_IDS:
+            current = drop_archived(cursor, table, chunk)
+            duplicates += len(chunk) - len(current)
+            chunk = current
+
+        changes_before = cursor.connection.total_changes
+        cursor.executemany(insert, chunk)
+        added = cursor.connection.total_changes - changes_before
+        inserted += added
+        duplicates += len(chunk) - added
+
+        since_commit += len(chunk)
+        if since_commit >= TRANSACTION_ROWS:
+            cursor.connection.commit()
+            since_commit = 0
+    cursor.connection.commit()
+    return inserted, rejected, duplicates
+
+
+def main(db_path, arguments):
+    if not arguments or len(arguments) % 2 or any(table not in TABLE_COLUMNS for table in arguments[::2]):
+        print(f"Usage: python miniproject.py import <dbname> <table> <file> [<table> <file> ...]\n"
+              f"Tables: {', '.join(TABLE_COLUMNS)}")
+        sys.exit(1)
+
+    miniproject.connect_to_database(db_path, readers=1)
+    with miniproject.pool.writer() as cursor:
+        with deferred_maintenance(cursor):
+            for table, path in zip(arguments[::2], arguments[1::2]):
+                start = time.perf_counter()
+                inserted, rejected, duplicates = import_file(cursor, table, path)
+                elapsed = time.perf_counter() - start
+                print(f"{table}: {inserted} rows imported from {path} in {elapsed:.1f}s "
+                      f"({inserted / max(elapsed, 1e-9):.0f} rows/sec), {rejected} invalid, {duplicates} duplicates skipped")
+
+        # Report rows whose member, book or borrowing does not exist
+        for table in dict.fromkeys(arguments[::2]):
+            cursor.execute(f'PRAGMA foreign_key_check({table})')
+            violations = len(cursor.fetchall())
+            if violations:
+                print(f"Warning: {violations} rows in {table} reference a missing member, book or borrowing.")
+    miniproject.close_database()
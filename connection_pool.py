@@ -0,0 +1,93 @@
+"""
+Bounded SQLite connection pool used by miniproject.py.
+
+SQLite allows any number of readers but only one writer at a time, so the pool holds exactly one writer connection
+(guarded by a lock) and a fixed number of read-only connections. The database is switched to WAL mode so that the
+readers keep working from their snapshot while the writer commits.
+"""
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+BUSY_TIMEOUT_MS = 5000  # How long a connection waits for a lock held by another process before giving up
+CACHE_SIZE_KB = 64 * 1024  # Page cache per connection
+MMAP_SIZE = 256 * 1024 * 1024  # Read the database file through memory mapping, up to this many bytes
+CACHED_STATEMENTS = 256  # Prepared statements kept per connection, keyed by SQL text
+
+
+class ConnectionPool:
+    """
+    One writer connection plus a bounded set of reader connections to the same database file.
+    With a QueryStats object, every cursor handed out reports its statements to it (see query_stats.py).
+    """
+
+    def __init__(self, db_path, readers=4, query_stats=None):
+        self.db_path = db_path
+        self.query_stats = query_stats
+        self.cursor_factory = query_stats.cursor if query_stats else sqlite3.Cursor
+        self.writer_connection = self.connect(read_only=False)
+        self.writer_lock = threading.Lock()
+
+        self.readers = queue.Queue(maxsize=readers)
+        for _ in range(readers):
+            self.readers.put(self.connect(read_only=True))
+
+    def connect(self, read_only):
+        """Open a connection with the pragmas shared by every pooled connection."""
+        # check_same_thread is off because a pooled connection is used by whichever thread checked it out
+        connection = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False,
+                                     cached_statements=CACHED_STATEMENTS)
+        cursor = connection.cursor()
+        if not read_only:
+            cursor.execute('PRAGMA journal_mode=WAL')  # Stored in the database file, readers pick it up
+        cursor.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+        cursor.execute('PRAGMA synchronous=NORMAL')  # In WAL mode only checkpoints need a full fsync
+        cursor.execute(f'PRAGMA cache_size=-{CACHE_SIZE_KB}')
+        cursor.execute(f'PRAGMA mmap_size={MMAP_SIZE}')
+        cursor.execute('PRAGMA temp_store=MEMORY')
+        cursor.execute('PRAGMA foreign_keys=ON')
+        if read_only:
+            cursor.execute('PRAGMA query_only=ON')  # Guard against a write slipping through a reader
+        cursor.close()
+        return connection
+
+    @contextmanager
+    def reader(self):
+        """Check out a reader connection and yield a cursor on it; blocks while all readers are in use."""
+        connection = self.readers.get()
+        try:
+            cursor = connection.cursor(self.cursor_factory)
+            yield cursor
+            cursor.close()
+        finally:
+            if connection.in_transaction:
+                connection.rollback()  # Never hand back a connection holding an old snapshot
+            self.readers.put(connection)
+
+    @contextmanager
+    def writer(self):
+        """Take the single writer connection and yield a cursor on it; blocks while another thread is writing."""
+        with self.writer_lock:
+            cursor = self.writer_connection.cursor(self.cursor_factory)
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+                if self.writer_connection.in_transaction:
+                    self.writer_connection.rollback()  # Uncommitted work is discarded, never left for the next caller
+
+    def close(self):
+        """Close every connection, refreshing the planner statistics on the way out, and save any query statistics."""
+        try:
+            with self.writer_lock:
+                try:
+                    self.writer_connection.execute('PRAGMA optimize')
+                except sqlite3.OperationalError:
+                    pass  # Database locked by another process's writes; the statistics are refreshed another time
+                self.writer_connection.close()
+        finally:
+            while not self.readers.empty():
+                self.readers.get_nowait().close()
+            if self.query_stats:
+                self.query_stats.save()
@@ -0,0 +1,191 @@
+"""
+Deterministic generator of synthetic library databases for benchmarking.
+
+The same seed, sizes and --until date always give the same database. Popularity is skewed the way a real library
+is: a few books are borrowed far more often than the rest and a few members borrow far more than the rest
+(both drawn from a Zipf-like distribution), titles are built from a vocabulary in which some words are much more
+common, about 3% of the borrowings are still open and some closed ones were returned late, with the penalties
+for those partly paid. The members are member<i>@example.com, all with the password 'pwd'.
+
+Usage: python datagen.py <dbname> [--size 10k|1m|10m] [--books N] [--members N] [--borrowings N] [--seed S]
+                                    [--until YYYY-MM-DD]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import time
+from datetime import date, timedelta
+from itertools import islice
+
+import miniproject
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.sql')
+
+# Preset sizes: (books, members, borrowings)
+SIZES = {
+    '10k': (10_000, 1_000, 10_000),
+    '1m': (1_000_000, 100_000, 1_000_000),
+    '10m': (10_000_000, 1_000_000, 10_000_000),
+}
+CHUNK_ROWS = 50000  # Rows per executemany call
+HISTORY_DAYS = 730  # Borrowings start within this many days before --until
+OPEN_FRACTION = 0.03  # Share of borrowings that are still open
+LATE_FRACTION = 0.15  # Share of closed borrowings returned after the loan period
+REVIEW_FRACTION = 0.1  # Share of closed borrowings that were reviewed
+
+# Ordered from most to least common, so skewed() picks the first ones most often
+WORDS = ['the', 'of', 'and', 'history', 'river', 'night', 'love', 'war', 'city', 'stone', 'garden', 'winter',
+         'king', 'ocean', 'song', 'house', 'light', 'shadow', 'forest', 'empire', 'secret', 'journey', 'silent',
+         'golden', 'broken', 'last', 'first', 'dark', 'summer', 'island', 'mountain', 'queen', 'letters', 'fire',
+         'memory', 'bridge', 'storm', 'glass', 'harbor', 'machine', 'children', 'north', 'winds', 'mirror',
+         'station', 'orchard', 'lantern', 'desert', 'signal', 'archive', 'compass', 'meridian', 'quartz', 'voyage']
+FIRST_NAMES = ['anna', 'ben', 'chen', 'dara', 'emil', 'fatima', 'george', 'hana', 'ivan', 'julia', 'kofi', 'lena',
+               'marco', 'nadia', 'omar', 'priya', 'quinn', 'rosa', 'sven', 'tariq', 'uma', 'victor', 'wei', 'yara']
+LAST_NAMES = ['smith', 'garcia', 'wang', 'muller', 'rossi', 'kim', 'novak', 'silva', 'ahmed', 'johansson',
+              'okafor', 'tanaka', 'dubois', 'kowalski', 'haddad', 'ivanova', 'murphy', 'singh', 'larsen', 'costa']
+FACULTIES = ['science', 'arts', 'engineering', 'business', 'medicine', 'law', 'education']
+SKEW_OFFSET = 10  # See skewed()
+SCATTER_PRIME = 2654435761  # Multiplier of scatter(); a prime, so it is coprime with any size below it
+
+
+def skewed(rng, n):
+    """
+    Return an index in [0, n) from a Zipf-like distribution: index 0 is the most likely and the probability falls
+    off as 1 / (index + SKEW_OFFSET). The offset keeps the very top from taking an unrealistic share.
+    """
+    return min(int(SKEW_OFFSET * ((n + SKEW_OFFSET) / SKEW_OFFSET) ** rng.random()) - SKEW_OFFSET, n - 1)
+
+
+def scatter(index, n):
+    """Map an index in [0, n) to a distinct one, so that the popular books and members are spread over all ids."""
+    return index * SCATTER_PRIME % n
+
+
+def book_rows(rng, books):
+    for book_id in range(1, books + 1):
+        title = ' '.join(WORDS[skewed(rng, len(WORDS))] for _ in range(rng.randint(2, 4)))
+        author = f'{rng.choice(FIRST_NAMES)} {LAST_NAMES[skewed(rng, len(LAST_NAMES))]}'
+        yield book_id, title, author, rng.randint(1900, 2025)
+
+
+def member_rows(rng, members):
+    for i in range(members):
+        name = f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+        yield f'member{i}@example.com', 'pwd', name, rng.randint(1950, 2006), rng.choice(FACULTIES)
+
+
+def history_rows(rng, books, members, borrowings, until):
+    """
+    Yield ('borrowing', row), ('penalty', row) and ('review', row) records in bid order. Open borrowings come
+    last and are each on a different book, as the database allows only one open loan per book.
+    """
+    dates = [str(until - timedelta(days=offset)) for offset in range(HISTORY_DAYS + 1)]
+    loan_days = miniproject.LOAN_PERIOD_DAYS
+    open_loans = min(int(borrowings * OPEN_FRACTION), books)
+    closed_loans = borrowings - open_loans
+
+    for bid in range(1, closed_loans + 1):
+        member = f'member{scatter(skewed(rng, members), members)}@example.com'
+        book_id = scatter(skewed(rng, books), books) + 1
+        start = rng.randrange(1, HISTORY_DAYS + 1)  # Days before 'until'
+        kept = rng.randint(loan_days + 1, loan_days * 3) if rng.random() < LATE_FRACTION else rng.randint(1, loan_days)
+        kept = min(kept, start)
+        yield 'borrowing', (bid, member, book_id, dates[start], dates[start - kept])
+
+        if kept > loan_days:
+            amount = kept - loan_days
+            paid = rng.choice([0, 0, 0, amount, amount, amount // 2])
+            yield 'penalty', (bid, amount, paid)
+        if rng.random() < REVIEW_FRACTION:
+            rating = min(5, max(1, round(rng.gauss(3.8, 1))))
+            yield 'review', (book_id, member, rating, 'generated review', dates[start - kept])
+
+    on_loan = set()
+    for bid in range(closed_loans + 1, borrowings + 1):
+        book_id = scatter(skewed(rng, books), books) + 1
+        while book_id in on_loan:
+            book_id = rng.randint(1, books)
+        on_loan.add(book_id)
+        member = f'member{scatter(skewed(rng, members), members)}@example.com'
+        yield 'borrowing', (bid, member, book_id, dates[rng.randrange(HISTORY_DAYS // 12)], None)
+
+
+def insert_chunks(connection, insert, rows):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, CHUNK_ROWS))
+        if not chunk:
+            return
+        connection.executemany(insert, chunk)
+
+
+def insert_history(connection, records):
+    """Insert the mixed records of history_rows(), buffering each kind up to CHUNK_ROWS rows."""
+    inserts = {
+        'borrowing': 'INSERT INTO borrowings (bid, member, book_id, start_date, end_date) VALUES (?, ?, ?, ?, ?)',
+        'penalty': 'INSERT INTO penalties (bid, amount, paid_amount) VALUES (?, ?, ?)',
+        'review': 'INSERT INTO reviews (book_id, member, rating, rtext, rdate) VALUES (?, ?, ?, ?, ?)',
+    }
+    buffers = {kind: [] for kind in inserts}
+    for kind, row in records:
+        buffer = buffers[kind]
+        buffer.append(row)
+        if len(buffer) >= CHUNK_ROWS:
+            connection.executemany(inserts[kind], buffer)
+            buffer.clear()
+    for kind, buffer in buffers.items():
+        connection.executemany(inserts[kind], buffer)
+
+
+def generate(db_path, books, members, borrowings, seed=1, until=None):
+    """Create a new database at db_path with the given sizes, then apply the migrations (indexes, search index)."""
+    until = until or date.today()
+    if os.path.exists(db_path):
+        raise FileExistsError(f'{db_path} already exists')
+
+    connection = sqlite3.connect(db_path)
+    with open(SCHEMA_PATH) as schema:
+        connection.executescript(schema.read())
+    connection.execute('PRAGMA journal_mode=OFF')  # A failed run leaves a half-built file to delete, nothing more
+    connection.execute('PRAGMA synchronous=OFF')
+
+    # Each table gets its own generator seeded from 'seed', so changing one size leaves the other tables alone
+    insert_chunks(connection, 'INSERT INTO books (book_id, title, author, pyear) VALUES (?, ?, ?, ?)',
+                  book_rows(random.Random(f'{seed}-books'), books))
+    insert_chunks(connection, 'INSERT INTO members (email, passwd, name, byear, faculty) VALUES (?, ?, ?, ?, ?)',
+                  member_rows(random.Random(f'{seed}-members'), members))
+    insert_history(connection, history_rows(random.Random(f'{seed}-history'), books, members, borrowings, until))
+    connection.commit()
+    connection.close()
+
+    # Building the indexes, search index and book statistics once over the full tables is much faster than
+    # keeping them up to date row by row
+    miniproject.connect_to_database(db_path, readers=1)
+    miniproject.close_database()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Create a synthetic library database.')
+    parser.add_argument('db_path')
+    parser.add_argument('--size', choices=SIZES, default='10k', help='preset for the three sizes below')
+    parser.add_argument('--books', type=int)
+    parser.add_argument('--members', type=int)
+    parser.add_argument('--borrowings', type=int)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--until', type=date.fromisoformat, help='date of the most recent activity (default today)')
+    args = parser.parse_args()
+
+    books, members, borrowings = SIZES[args.size]
+    books = args.books or books
+    members = args.members or members
+    borrowings = args.borrowings if args.borrowings is not None else borrowings
+
+    start = time.perf_counter()
+    generate(args.db_path, books, members, borrowings, args.seed, args.until)
+    print(f"Created {args.db_path}: {books} books, {members} members, {borrowings} borrowings "
+          f"(seed {args.seed}) in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
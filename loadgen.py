@@ -0,0 +1,154 @@
+"""
+Load generator for the HTTP server (python miniproject.py serve).
+
+Opens a number of concurrent keep-alive client connections, logs each one in as a different member and then
+sends a mix of profile, search, borrow, return, penalty and payment requests for a fixed time. Prints the request
+rate and the p50/p99 latency of every endpoint.
+
+Without --url a synthetic database is created and a server is started on it for the duration of the run.
+
+Usage: python loadgen.py [--url http://127.0.0.1:8080] [--clients 32] [--seconds 10]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+import bench_pool
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+async def request(reader, writer, method, path, body=None, token=None):
+    """Send one request on an open connection and return (status, decoded JSON payload)."""
+    data = json.dumps(body).encode() if body is not None else b''
+    head = f'{method} {path} HTTP/1.1\r\nHost: library\r\nContent-Length: {len(data)}\r\n'
+    if token:
+        head += f'Authorization: Bearer {token}\r\n'
+    writer.write(head.encode() + b'\r\n' + data)
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+
+async def client(host, port, member, deadline, latencies, errors, seed):
+    """One simulated member: log in, then keep sending a random mix of requests until the deadline."""
+    rng = random.Random(seed)
+    reader, writer = await asyncio.open_connection(host, port)
+
+    async def timed(endpoint, method, path, body=None, token=None):
+        start = time.perf_counter()
+        result = await request(reader, writer, method, path, body, token)
+        latencies.setdefault(endpoint, []).append(time.perf_counter() - start)
+        if result[0] >= 500:
+            errors[endpoint] = errors.get(endpoint, 0) + 1
+        return result
+
+    status, payload = await timed('login', 'POST', '/login', {'email': member, 'password': 'pwd'})
+    if status != 200:
+        raise RuntimeError(f'login failed for {member}: {payload}')
+    token = payload['token']
+
+    while time.perf_counter() < deadline:
+        choice = rng.random()
+        if choice < 0.3:
+            await timed('profile', 'GET', '/profile', token=token)
+        elif choice < 0.7:
+            keyword = rng.choice(bench_pool.WORDS)
+            status, payload = await timed('search', 'GET', f'/search?q={keyword}', token=token)
+            if payload.get('next') and rng.random() < 0.5:
+                await timed('search', 'GET', f'/search?q={keyword}&after={payload["next"]}', token=token)
+        elif choice < 0.9:
+            status, payload = await timed('borrow', 'POST', '/borrow', {'book_id': rng.randint(1, bench_pool.BOOKS)}, token)
+            if status == 200:
+                review = {'bid': payload['bid'], 'rating': rng.randint(1, 5), 'review': 'load test'} if rng.random() < 0.5 else {'bid': payload['bid']}
+                await timed('return', 'POST', '/return', review, token)
+        else:
+            status, payload = await timed('penalties', 'GET', '/penalties', token=token)
+            if payload.get('penalties'):
+                penalty = payload['penalties'][0]
+                await timed('pay', 'POST', '/pay', {'pid': penalty['pid'], 'amount': 1}, token)
+
+    writer.close()
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+async def run(host, port, clients, seconds):
+    latencies = {}
+    errors = {}  # Endpoint -> number of 5xx answers
+    deadline = time.perf_counter() + seconds
+    start = time.perf_counter()
+    await asyncio.gather(*(client(host, port, f'member{i % bench_pool.MEMBERS}@example.com', deadline, latencies, errors, i)
+                           for i in range(clients)))
+    elapsed = time.perf_counter() - start
+
+    print(f"{'endpoint':<10} {'requests':>9} {'req/sec':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for endpoint, values in sorted(latencies.items()):
+        print(f"{endpoint:<10} {len(values):>9} {len(values) / elapsed:>9.1f} "
+              f"{percentile(values, 0.5) * 1000:>8.2f} {percentile(values, 0.99) * 1000:>8.2f} {errors.get(endpoint, 0):>7}")
+    total = sum(len(values) for values in latencies.values())
+    print(f"{'total':<10} {total:>9} {total / elapsed:>9.1f}")
+
+
+def start_server(db_path):
+    """Start 'miniproject.py serve' on a free port and wait until it accepts connections."""
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    process = subprocess.Popen([sys.executable, os.path.join(HERE, 'miniproject.py'), 'serve', db_path, str(port)],
+                               stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+            return process, port
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('server did not start')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load generator for the library HTTP server.')
+    parser.add_argument('--url', help='server to test; by default one is started on a synthetic database')
+    parser.add_argument('--clients', type=int, default=32, help='concurrent client connections')
+    parser.add_argument('--seconds', type=float, default=10, help='duration of the run')
+    args = parser.parse_args()
+
+    if args.url:
+        url = urlsplit(args.url)
+        asyncio.run(run(url.hostname, url.port or 80, args.clients, args.seconds))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'loadgen.db')
+        bench_pool.create_database(db_path)
+        process, port = start_server(db_path)
+        try:
+            asyncio.run(run('127.0.0.1', port, args.clients, args.seconds))
+        finally:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == '__main__':
+    main()
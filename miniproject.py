@@ -1,13 +1,486 @@
 from getpass import getpass
+import itertools
+import os
+import re
 import sqlite3
-from datetime import datetime
+import sys
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import query_stats
+import recommendations
+from connection_pool import ConnectionPool
+from search_cache import SearchCache
+from trigram_index import TrigramIndex
+from write_queue import WriteQueue
+
+# Number of days a book may be kept before it is overdue. Used for return deadlines, the profile's overdue count
+# and penalty amounts (one dollar per overdue day). Can be changed with LIBRARY_LOAN_PERIOD_DAYS.
+LOAN_PERIOD_DAYS = int(os.environ.get('LIBRARY_LOAN_PERIOD_DAYS', 20))
+
+# Connections shared by every operation, created by connect_to_database(). Reads go through pool.reader(),
+# writes through pool.writer(), so several members can be served at the same time.
+pool = None
+
+# Group-commit queue for the write paths, started by connect_to_database() when LIBRARY_GROUP_COMMIT=1
+# (see write_queue.py). When it is None every write commits on its own.
+write_queue = None
+
+# "Also borrowed" recommendations loaded from <dbname>.recommendations when that file exists (see recommendations.py).
+related_books = None
+
+
+def connect_to_database(db_path, readers=4):
+    global pool, write_queue, related_books, word_index  # Declare 'pool' as a global variable to use it outside the function.
+    if write_queue:
+        write_queue.close()  # Finish the writes queued for the previous database
+        write_queue = None
+    if related_books:
+        related_books.close()
+        related_books = None
+    word_index = None  # Loaded again from the new database when it is first needed
+    # One writer plus 'readers' read-only connections to the database, timing every statement if LIBRARY_QUERY_STATS=1.
+    pool = ConnectionPool(db_path, readers, query_stats.QueryStats(db_path) if query_stats.enabled() else None)
+    with pool.writer() as cursor:
+        migrate_database(cursor)  # Bring the indexes, triggers and helper tables up to the current schema version.
+        restore_deferred_objects(cursor)  # Finish an interrupted bulk import, if any.
+    if os.environ.get('LIBRARY_GROUP_COMMIT') == '1':
+        write_queue = WriteQueue(pool, immediate_transaction)
+    if os.path.exists(recommendations.recommendations_path(db_path)):
+        try:
+            related_books = recommendations.Recommendations(recommendations.recommendations_path(db_path))
+        except ValueError:
+            pass  # A file in an older format, unused until build-recommendations is run again
+
+
+def close_database():
+    """Commit any queued writes and close every connection."""
+    global write_queue, related_books
+    if write_queue:
+        write_queue.close()
+        write_queue = None
+    if related_books:
+        related_books.close()
+        related_books = None
+    pool.close()
+
+
+def run_write(operation, *args):
+    """
+    Run a write, a function taking the writer cursor followed by 'args' that neither commits nor rolls back, and
+    return its result once it is committed: through the group-commit queue when it is running, otherwise in a
+    transaction of its own.
+    """
+    if write_queue:
+        return write_queue.submit(operation, *args).result()
+    with pool.writer() as cursor, immediate_transaction(cursor):
+        return operation(cursor, *args)
+
+
+# Set to True by migrate_database() when the FTS5 index over books(title, author) is usable.
+fts_enabled = False
+
+
+def setup_search_index(cursor):
+    """
+    Create the FTS5 index over book titles and authors together with the triggers that keep it in sync with 'books'.
+    The trigram tokenizer is used so that the index answers the same substring matches as LIKE '%keyword%'.
+    If this SQLite build has no FTS5 (or no trigram tokenizer), searching falls back to the plain LIKE query.
+    """
+    try:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'books_fts'")
+        index_exists = cursor.fetchone() is not None
+
+        # External-content table: the index stores only the trigrams, the text itself stays in 'books'
+        cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+            title, author, content='books', content_rowid='book_id', tokenize='trigram'
+        )''')
+
+        # Triggers keep the index up to date on every insert, delete and title/author update of a book
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN
+            INSERT INTO books_fts (rowid, title, author) VALUES (new.book_id, new.title, new.author);
+        END''')
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN
+            INSERT INTO books_fts (books_fts, rowid, title, author) VALUES ('delete', old.book_id, old.title, old.author);
+        END''')
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE OF book_id, title, author ON books BEGIN
+            INSERT INTO books_fts (books_fts, rowid, title, author) VALUES ('delete', old.book_id, old.title, old.author);
+            INSERT INTO books_fts (rowid, title, author) VALUES (new.book_id, new.title, new.author);
+        END''')
+
+        if not index_exists:
+            # First time the index is created: fill it from the books that are already in the database
+            cursor.execute("INSERT INTO books_fts (books_fts) VALUES ('rebuild')")
+        cursor.connection.commit()
+    except sqlite3.OperationalError:
+        # FTS5 or the trigram tokenizer is not compiled into this SQLite build
+        cursor.connection.rollback()
+
+
+def setup_book_stats(cursor):
+    """
+    Create the 'book_stats' table holding each book's rating total, rating count and number of open loans,
+    together with the triggers on 'reviews' and 'borrowings' that keep it up to date.
+    The table is filled from the existing reviews and borrowings the first time it is created.
+    """
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'book_stats'")
+    stats_exist = cursor.fetchone() is not None
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS book_stats (
+        book_id INTEGER PRIMARY KEY,
+        rating_sum INTEGER NOT NULL DEFAULT 0,  -- Sum of all non-null review ratings
+        rating_count INTEGER NOT NULL DEFAULT 0,  -- Number of non-null review ratings
+        open_loans INTEGER NOT NULL DEFAULT 0  -- Number of borrowings with no end_date yet
+    )''')
+
+    # Reviews: add the new rating to the totals and remove the old one
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS book_stats_review_insert AFTER INSERT ON reviews BEGIN
+        INSERT INTO book_stats (book_id, rating_sum, rating_count) VALUES (new.book_id, IFNULL(new.rating, 0), new.rating IS NOT NULL)
+        ON CONFLICT (book_id) DO UPDATE SET rating_sum = rating_sum + excluded.rating_sum, rating_count = rating_count + excluded.rating_count;
+    END''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS book_stats_review_delete AFTER DELETE ON reviews BEGIN
+        UPDATE book_stats SET rating_sum = rating_sum - IFNULL(old.rating, 0), rating_count = rating_count - (old.rating IS NOT NULL)
+        WHERE book_id = old.book_id;
+    END''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS book_stats_review_update AFTER UPDATE OF book_id, rating ON reviews BEGIN
+        UPDATE book_stats SET rating_sum = rating_sum - IFNULL(old.rating, 0), rating_count = rating_count - (old.rating IS NOT NULL)
+        WHERE book_id = old.book_id;
+        INSERT INTO book_stats (book_id, rating_sum, rating_count) VALUES (new.book_id, IFNULL(new.rating, 0), new.rating IS NOT NULL)
+        ON CONFLICT (book_id) DO UPDATE SET rating_sum = rating_sum + excluded.rating_sum, rating_count = rating_count + excluded.rating_count;
+    END''')
+
+    # Borrowings: a loan counts as open while its end_date is NULL
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS book_stats_borrowing_insert AFTER INSERT ON borrowings WHEN new.end_date IS NULL BEGIN
+        INSERT INTO book_stats (book_id, open_loans) VALUES (new.book_id, 1)
+        ON CONFLICT (book_id) DO UPDATE SET open_loans = open_loans + 1;
+    END''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS book_stats_borrowing_delete AFTER DELETE ON borrowings WHEN old.end_date IS NULL BEGIN
+        UPDATE book_stats SET open_loans = open_loans - 1 WHERE book_id = old.book_id;
+    END''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS book_stats_borrowing_update AFTER UPDATE OF book_id, end_date ON borrowings BEGIN
+        UPDATE book_stats SET open_loans = open_loans - (old.end_date IS NULL) WHERE book_id = old.book_id;
+        INSERT INTO book_stats (book_id, open_loans) VALUES (new.book_id, new.end_date IS NULL)
+        ON CONFLICT (book_id) DO UPDATE SET open_loans = open_loans + excluded.open_loans;
+    END''')
+
+    if not stats_exist:
+        rebuild_book_stats(cursor)
+    cursor.connection.commit()
+
+
+# Recomputes the per-book totals from scratch; used both to fill and to check 'book_stats'.
+BOOK_STATS_QUERY = '''
+SELECT b.book_id,
+       IFNULL(r.rating_sum, 0) AS rating_sum,
+       IFNULL(r.rating_count, 0) AS rating_count,
+       IFNULL(l.open_loans, 0) AS open_loans
+FROM books b
+LEFT JOIN (SELECT book_id, SUM(rating) AS rating_sum, COUNT(rating) AS rating_count
+           FROM reviews GROUP BY book_id) r ON r.book_id = b.book_id
+LEFT JOIN (SELECT book_id, COUNT(*) AS open_loans
+           FROM borrowings WHERE end_date IS NULL GROUP BY book_id) l ON l.book_id = b.book_id
+'''
+
+
+def rebuild_book_stats(cursor):
+    """Recompute 'book_stats' from the reviews and borrowings tables."""
+    cursor.execute('DELETE FROM book_stats')
+    cursor.execute('INSERT INTO book_stats (book_id, rating_sum, rating_count, open_loans) ' + BOOK_STATS_QUERY)
+    cursor.connection.commit()
+
+
+def verify_book_stats(cursor):
+    """Compare 'book_stats' with freshly computed totals and return the ids of the books whose stored totals differ."""
+    cursor.execute(f'''
+    SELECT e.book_id
+    FROM ({BOOK_STATS_QUERY}) e
+    LEFT JOIN book_stats s ON s.book_id = e.book_id
+    WHERE (e.rating_sum, e.rating_count, e.open_loans)
+          IS NOT (IFNULL(s.rating_sum, 0), IFNULL(s.rating_count, 0), IFNULL(s.open_loans, 0))
+    ''')
+    return [row[0] for row in cursor.fetchall()]
+
+
+def setup_loan_index(cursor):
+    """
+    Create a partial unique index allowing at most one open borrowing (end_date IS NULL) per book.
+    Together with the single-statement insert in borrow_book() this makes double lending impossible,
+    even with several sessions borrowing at the same time.
+    The index is recorded in 'deferred_objects' and created by restore_deferred_objects(), which runs right after the
+    migrations. If a book is already lent out twice it cannot be: like an index the data of an import violates, it
+    is reported and tried again on every start until the extra loans are closed. The insert in borrow_book() refuses
+    new double loans meanwhile.
+    """
+    setup_import_recovery(cursor)  # Its table does not exist yet on a database migrating from before step 8
+    cursor.execute('''
+    INSERT OR REPLACE INTO deferred_objects (name, type, sql)
+    VALUES ('borrowings_open_loan', 'index', 'CREATE UNIQUE INDEX IF NOT EXISTS borrowings_open_loan
+    ON borrowings (book_id) WHERE end_date IS NULL')
+    ''')
+    cursor.connection.commit()
+
+
+def create_lookup_indexes(cursor):
+    """
+    Create the indexes used by the member-facing lookups so that none of them has to scan a whole table:
+    login by lower(email), a member's borrowings (open ones in particular), penalties by borrowing and reviews by book.
+    ANALYZE afterwards gives the query planner statistics to choose between them.
+    """
+    cursor.execute('CREATE INDEX IF NOT EXISTS members_lower_email ON members (lower(email))')
+    cursor.execute('CREATE INDEX IF NOT EXISTS borrowings_member ON borrowings (member, end_date, start_date)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS borrowings_member_open ON borrowings (member, start_date) WHERE end_date IS NULL')
+    cursor.execute('CREATE INDEX IF NOT EXISTS penalties_bid ON penalties (bid)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS reviews_book ON reviews (book_id, rating)')
+    cursor.execute('ANALYZE')
+    cursor.connection.commit()
+
+
+def setup_penalty_assessment(cursor):
+    """
+    Create the single-row table in which assess_penalties() records the last borrowing id it has processed,
+    so that an interrupted run resumes after the last completed chunk instead of starting over.
+    """
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS penalty_assessment (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        last_bid INTEGER NOT NULL
+    )
+    ''')
+    cursor.execute('INSERT OR IGNORE INTO penalty_assessment (id, last_bid) VALUES (1, 0)')
+    cursor.connection.commit()
+
+
+def setup_archive(cursor):
+    """
+    Create the tables archive_borrowings() moves old closed borrowings and their penalties into. They have the same
+    columns and ids as 'borrowings' and 'penalties', so an archived penalty still leads to its borrowing and member.
+    """
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS borrowings_archive (
+        bid INTEGER PRIMARY KEY,
+        member CHAR(100) NOT NULL REFERENCES members,
+        book_id INTEGER NOT NULL REFERENCES books,
+        start_date DATE,
+        end_date DATE
+    )''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS penalties_archive (
+        pid INTEGER PRIMARY KEY,
+        bid INTEGER NOT NULL REFERENCES borrowings_archive,
+        amount INTEGER,
+        paid_amount INTEGER
+    )''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS borrowings_archive_member ON borrowings_archive (member)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS penalties_archive_bid ON penalties_archive (bid)')
+    cursor.connection.commit()
+
+
+def setup_word_index(cursor):
+    """
+    Create the word-level FTS5 index over book titles and authors, whose vocabulary the typo-tolerant search loads
+    its words from, and the 'book_edits' log of title and author changes that tells it which books to read again.
+    Without FTS5 the words are read from 'books' itself.
+    """
+    cursor.execute('CREATE TABLE IF NOT EXISTS book_edits (seq INTEGER PRIMARY KEY, book_id INTEGER NOT NULL)')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS book_edits_log AFTER UPDATE OF title, author ON books BEGIN
+        INSERT INTO book_edits (book_id) VALUES (new.book_id);
+    END''')
+    cursor.connection.commit()
+
+    try:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'books_words'")
+        index_exists = cursor.fetchone() is not None
+
+        # Words as written (no diacritics removed) so that a corrected keyword matches the titles; only which
+        # words occur is needed, so the index stores no positions
+        cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS books_words USING fts5(
+            title, author, content='books', content_rowid='book_id', tokenize='unicode61 remove_diacritics 0',
+            detail=none
+        )''')
+        cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS books_words_vocab USING fts5vocab(books_words, 'row')")
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS books_words_insert AFTER INSERT ON books BEGIN
+            INSERT INTO books_words (rowid, title, author) VALUES (new.book_id, new.title, new.author);
+        END''')
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS books_words_delete AFTER DELETE ON books BEGIN
+            INSERT INTO books_words (books_words, rowid, title, author) VALUES ('delete', old.book_id, old.title, old.author);
+        END''')
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS books_words_update AFTER UPDATE OF book_id, title, author ON books BEGIN
+            INSERT INTO books_words (books_words, rowid, title, author) VALUES ('delete', old.book_id, old.title, old.author);
+            INSERT INTO books_words (rowid, title, author) VALUES (new.book_id, new.title, new.author);
+        END''')
+
+        if not index_exists:
+            cursor.execute("INSERT INTO books_words (books_words) VALUES ('rebuild')")
+        cursor.connection.commit()
+    except sqlite3.OperationalError:
+        # FTS5 is not compiled into this SQLite build
+        cursor.connection.rollback()
+
+
+def setup_import_recovery(cursor):
+    """
+    Create the table in which the bulk importer records the indexes and triggers it drops while it loads, in the same
+    transaction as the drops, so that they are recreated by restore_deferred_objects() even if the import never ends.
+    setup_loan_index() records its index there too.
+    """
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS deferred_objects (
+        name TEXT PRIMARY KEY,
+        type TEXT NOT NULL,
+        sql TEXT NOT NULL
+    )''')
+    cursor.connection.commit()
 
-def connect_to_database(db_path):
-    global connection, cursor  # Declare 'connection' and 'cursor' as global variables to use them outside the function.
-    connection = sqlite3.connect(db_path)  # Establish a new database connection using the provided database path.
-    cursor = connection.cursor()  # Create a cursor object to interact with the database.
-    cursor.execute('PRAGMA foreign_keys=ON;')  # Enable SQLite foreign key constraint support for referential integrity.
-    connection.commit()  # Commit any changes made by the PRAGMA statement to the database.
+
+def create_recommendation_indexes(cursor):
+    """
+    Create the indexes refresh-recommendations reads the pairs of given members and books through (see
+    recommendations.refresh()): borrowings and archived borrowings by book, reviews by member.
+    """
+    cursor.execute('CREATE INDEX IF NOT EXISTS borrowings_book ON borrowings (book_id, member)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS borrowings_archive_book ON borrowings_archive (book_id, member)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS reviews_member ON reviews (member, book_id)')
+    cursor.connection.commit()
+
+
+# Schema changes applied on top of schema.sql, in order. PRAGMA user_version records how many of them a
+# database has already received, so each step runs once per database. Only ever append to this list.
+MIGRATIONS = [
+    setup_search_index,  # 1: FTS5 index over book titles and authors
+    setup_book_stats,  # 2: per-book rating and open loan totals
+    setup_loan_index,  # 3: at most one open borrowing per book
+    create_lookup_indexes,  # 4: indexes for login, profile, return and penalty lookups
+    setup_penalty_assessment,  # 5: progress of the batch penalty assessment
+    setup_archive,  # 6: archive tables for old closed borrowings and their penalties
+    setup_word_index,  # 7: word vocabulary and book edit log for typo-tolerant search
+    setup_import_recovery,  # 8: indexes and triggers dropped by a bulk import that has not finished
+    create_recommendation_indexes,  # 9: pair lookups by book and member for refresh-recommendations
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def migrate_database(cursor):
+    """Apply the migrations the database has not received yet and detect whether the search index is usable."""
+    global fts_enabled
+    cursor.execute('PRAGMA user_version')
+    version = cursor.fetchone()[0]
+
+    for step_version, step in enumerate(MIGRATIONS[version:], start=version + 1):
+        step(cursor)
+        # Record each step as soon as it is done so that an interrupted upgrade resumes where it stopped
+        cursor.execute(f'PRAGMA user_version = {step_version}')
+        cursor.connection.commit()
+
+    try:
+        cursor.execute('SELECT 1 FROM books_fts LIMIT 0')
+        fts_enabled = True
+    except sqlite3.OperationalError:
+        fts_enabled = False  # The index was never created or this SQLite build cannot read it
+
+
+def restore_deferred_objects(cursor):
+    """
+    Recreate the indexes and triggers recorded in 'deferred_objects' (see setup_import_recovery()) and, if triggers
+    were among them, redo in one pass what they would have done row by row: rebuild the search and word indexes and
+    book_stats.
+    Runs at the end of every import and on connecting, which finishes an import that was killed or crashed.
+    An index the data violates is reported and left recorded, so it is tried again once the data is fixed.
+    Returns the number of objects recreated.
+    """
+    global word_index
+    cursor.execute('SELECT type, name, sql FROM deferred_objects')
+    saved = cursor.fetchall()
+    if not saved:
+        return 0
+
+    recreated = 0
+    for object_type, name, sql in saved:
+        cursor.execute('SELECT 1 FROM sqlite_master WHERE name = ?', (name,))
+        if cursor.fetchone():
+            continue  # Already recreated by a restore that stopped before it could clear its records
+        try:
+            cursor.execute(sql)
+            recreated += 1
+        except sqlite3.IntegrityError as error:
+            print(f"Warning: the data violates {name} ({error}), it was not created; fix the data and connect again.")
+
+    if any(object_type == 'trigger' for object_type, _, _ in saved):
+        if fts_enabled:
+            cursor.execute("INSERT INTO books_fts (books_fts) VALUES ('rebuild')")
+        # The word index must be rebuilt too: its triggers would otherwise delete words of books it never
+        # indexed, which corrupts it
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'books_words'")
+        if cursor.fetchone():
+            cursor.execute("INSERT INTO books_words (books_words) VALUES ('rebuild')")
+        word_index = None  # Loaded again with the new words
+        rebuild_book_stats(cursor)
+
+    # Only now are the records of the objects that exist again dropped, so that a restore cut short starts over
+    cursor.execute('DELETE FROM deferred_objects WHERE name IN (SELECT name FROM sqlite_master)')
+    cursor.connection.commit()
+    return recreated
+
+
+def check_query_plans(cursor):
+    """
+    Run EXPLAIN QUERY PLAN on the statements of the member-facing operations, with sample parameters, and return
+    (name, plan step) for every step that scans a whole table.
+    Scans of subquery results and of the FTS5 virtual table (which is searched through its own index) are fine.
+    """
+    queries = [
+        ('login', FIND_MEMBER_QUERY, ('a@b.c', 'pwd')),
+        ('member profile', MEMBER_SUMMARY_QUERY, (LOAN_PERIOD_DAYS, 'a@b.c')),
+        ('return list', OPEN_BORROWINGS_QUERY, ('2024-01-01', LOAN_PERIOD_DAYS, LOAN_PERIOD_DAYS, 'a@b.c')),
+        ('return', CLOSE_BORROWING, ('2024-01-01', 1, 'a@b.c')),
+        ('borrow', INSERT_BORROWING, ('a@b.c', '2024-01-01', 1, 1)),
+        ('unpaid penalties', UNPAID_PENALTIES_QUERY, ('a@b.c',)),
+        ('payment', APPLY_PAYMENT, (1, 1, 1, 'a@b.c')),
+    ]
+    if fts_enabled:
+        queries.append(('keyword search', *build_search_query('keyword')))
+
+    full_scans = []
+    for name, query, params in queries:
+        cursor.execute('EXPLAIN QUERY PLAN ' + query, params)
+        for row in cursor.fetchall():
+            detail = row[3]
+            if detail.startswith('SCAN ') and not detail.startswith('SCAN (') and 'VIRTUAL TABLE' not in detail:
+                full_scans.append((name, detail))
+    return full_scans
+
+
+@contextmanager
+def immediate_transaction(cursor):
+    """
+    Run the enclosed statements as one BEGIN IMMEDIATE transaction: the write lock is taken up front, so the
+    statements inside see no concurrent writer, and everything is rolled back if an exception is raised.
+    """
+    if cursor.connection.in_transaction:
+        cursor.connection.commit()  # Finish any implicit transaction so that BEGIN can be issued
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        yield cursor
+    except BaseException:
+        cursor.connection.rollback()
+        raise
+    cursor.connection.commit()
 
 
 def login():
@@ -20,17 +493,33 @@ def login():
 
 def check_credentials(email, pwd):
     """Check if email and pwd are valid for members."""
-    # Using parameterized queries to prevent SQL injection
-    cursor.execute("SELECT * FROM members WHERE lower(email) = ? AND passwd = ?", (email.lower(), pwd)) # case insensitive
-    user = cursor.fetchone()
+    user = find_member(email, pwd)
     if user:
         print("Login successful!\n")
-        return user[0]  # Assuming the first column is the email or user identifier
+        return user
     else:
         print("\nInvalid email or password\n")
         return None
 
 
+FIND_MEMBER_QUERY = "SELECT * FROM members WHERE lower(email) = ? AND passwd = ?"  # case insensitive
+
+
+def find_member(email, pwd):
+    """Return the stored email of the member with this email (case insensitive) and password, or None."""
+    # Using parameterized queries to prevent SQL injection
+    with pool.reader() as cursor:
+        cursor.execute(FIND_MEMBER_QUERY, (email.lower(), pwd))
+        user = cursor.fetchone()
+    return user[0] if user else None  # Assuming the first column is the email or user identifier
+
+
+# An email needs exactly one '@' with characters before it, and a '.' in the domain part after it.
+EMAIL_PATTERN = re.compile(r'[^@]+@[^@]*\.[^@]*')
+# A name must not be empty or contain any of ( ) [ ] = + - * & ^ % $ # @ !
+NAME_PATTERN = re.compile(r'[^()\[\]=+\-*&^%$#@!]+')
+
+
 def register():
     """
     Allows unregistered users to sign up by providing a unique email and other details.
@@ -41,21 +530,15 @@ def register():
     # Validate the email format
     while True:
         email = input("Enter your email: ").strip()
-        # Check if the email contains an '@' with characters before and after it, 
-        # and a '.' in the domain part after '@', also ensuring the email is split into exactly two parts by '@'.
-        if (email and '@' in email and '.' in email.split('@')[1] and 
-                len(email.split('@')) == 2 and
-                email.split('@')[0] and email.split('@')[1]):
+        if EMAIL_PATTERN.fullmatch(email):
             break  # Break the loop if the email is valid
         print("Invalid email format. Please enter a valid email with '@' and '.' in the domain part.")
 
     # Validate the name to ensure it doesn't contain special characters
     while True:
         name = input("Enter your name: ").strip().lower()  # Take the input and convert it to lowercase
-        # Define a list of invalid characters to check against
-        invalid_chars = ["(", ")", "[", "]", "=", "+", "-", "*", "&", "^", "%", "$", "#", "@", "!"]
-        # Check if the name contains any invalid characters
-        if name and all(x not in invalid_chars for x in name):
+        # Check if the name is empty or contains any invalid characters
+        if NAME_PATTERN.fullmatch(name):
             break  # Break the loop if the name is valid
         print("Invalid name input, please enter a valid name without special characters like '(', ')', '[', ']', '=', '+', '-', '*', '&', '^', '%', '$', '#', '@', '!'.")
 
@@ -71,78 +554,113 @@ def register():
     faculty = input("Enter your faculty (optional): ").strip().lower() or None  # Convert faculty to lowercase
 
     # Attempt to insert the new user into the database
-    try:
-        # Execute the INSERT query with parameters to prevent SQL injection
-        cursor.execute("INSERT INTO members (email, name, byear, faculty, passwd) VALUES (?, ?, ?, ?, ?)", 
-                       (email, name, byear, faculty, pwd))
-        connection.commit()  # Commit the transaction to ensure data is saved
+    if register_member(email, name, byear, faculty, pwd):
         print("Registration successful!\n")
-    except sqlite3.IntegrityError as e:
+    else:
         # Handle cases where the email is already registered
         print(f"This email is already registered: {email}\n")
 
 
+def register_member(email, name, byear, faculty, pwd):
+    """Insert a new member; returns False if the email is already registered."""
+    try:
+        run_write(insert_member, email, name, byear, faculty, pwd)
+    except sqlite3.IntegrityError:
+        return False
+    return True
+
+
+def insert_member(cursor, email, name, byear, faculty, pwd):
+    # Execute the INSERT query with parameters to prevent SQL injection
+    cursor.execute("INSERT INTO members (email, name, byear, faculty, passwd) VALUES (?, ?, ?, ?, ?)",
+                   (email, name, byear, faculty, pwd))
+
+
 
 #1
+# One pass over the member's borrowings (and their unpaid penalties) computing every figure shown on the profile.
+# Counts use DISTINCT bids because a borrowing joined with several penalties appears on several rows.
+# Archived borrowings are all closed with their penalties paid, so they only add to the previous borrowings,
+# which the subquery counts through the archive's member index.
+MEMBER_SUMMARY_QUERY = '''
+SELECT m.name, m.email, m.byear,
+       COUNT(DISTINCT CASE WHEN b.end_date IS NOT NULL THEN b.bid END)
+           + (SELECT COUNT(*) FROM borrowings_archive a WHERE a.member = m.email) AS previous_borrowings,
+       COUNT(DISTINCT CASE WHEN b.end_date IS NULL THEN b.bid END) AS current_borrowings,
+       COUNT(DISTINCT CASE WHEN b.end_date IS NULL AND julianday('now') - julianday(b.start_date) > ? THEN b.bid END) AS overdue_borrowings,
+       COUNT(p.pid) AS unpaid_penalties,
+       IFNULL(SUM(p.amount - IFNULL(p.paid_amount, 0)), 0.0) AS total_debt
+FROM members m
+LEFT JOIN borrowings b ON b.member = m.email
+LEFT JOIN penalties p ON p.bid = b.bid AND p.amount > IFNULL(p.paid_amount, 0)
+WHERE m.email = ?
+GROUP BY m.email
+'''
+
+# Optional cache of member summaries, keyed by email, enabled with LIBRARY_SUMMARY_CACHE=1.
+# Entries are dropped on every borrow, return and payment made through this program, and expire at midnight
+# because the overdue count depends on the date. Only enable it when no other process writes to the database.
+summary_cache_enabled = os.environ.get('LIBRARY_SUMMARY_CACHE') == '1'
+member_summaries = {}
+member_summaries_generation = 0  # Bumped by every invalidation, see get_member_summary()
+member_summaries_lock = threading.Lock()
+
+
+def get_member_summary(email):
+    """
+    Return (name, email, byear, previous, current and overdue borrowing counts, unpaid penalty count, total debt)
+    for a member, or None if there is no member with that email.
+    """
+    today = datetime.now().date()
+    if summary_cache_enabled:
+        with member_summaries_lock:
+            cached = member_summaries.get(email)
+            generation = member_summaries_generation
+        if cached and cached[0] == today:
+            return cached[1]
+
+    with pool.reader() as cursor:
+        cursor.execute(MEMBER_SUMMARY_QUERY, (LOAN_PERIOD_DAYS, email))
+        summary = cursor.fetchone()
+    if summary and summary_cache_enabled:
+        with member_summaries_lock:
+            # A write that committed and invalidated while the summary was read may be missing from it: don't cache it
+            if generation == member_summaries_generation:
+                member_summaries[email] = (today, summary)
+    return summary
+
+
+def invalidate_member_summary(email=None):
+    """Forget the cached summary of a member after their borrowings or penalties changed, or of every member."""
+    global member_summaries_generation
+    with member_summaries_lock:
+        member_summaries_generation += 1
+        if email is None:
+            member_summaries.clear()
+        else:
+            member_summaries.pop(email, None)
+
+
 def get_member_profile(email):
     """
     Display the member's profile including personal information, previous borrowings,
     current borrowings, overdue borrowings, and penalties.
     """
-    # Assuming 'connection' and 'cursor' are database connection and cursor objects defined outside this function
-    global connection, cursor
-    
-    # Fetch and display personal information of a member using their email address
-    cursor.execute('SELECT name, email, byear FROM members WHERE email = ?', (email,))
-    member_info = cursor.fetchone()  # Retrieve the first (and should be only) result of the query
-    if member_info:
-        # If a member is found, print their name, email, and birth year
-        print(f"Personal Information:\nName: {member_info[0]}\nEmail: {member_info[1]}\nBirth Year: {member_info[2]}\n")
-    else:
+    # Fetch the personal information, borrowing counts and penalty totals of a member in one query
+    summary = get_member_summary(email)
+    if not summary:
         # If no member matches the provided email, print a message and exit the function
         print("Member not found.")
         return
 
-    # Calculate and display borrowing counts for the member
-
-    # Count the number of books previously borrowed and returned by the member
-    cursor.execute('''
-    SELECT COUNT(*) FROM borrowings
-    WHERE member = ? AND end_date IS NOT NULL
-    ''', (email,))
-    previous_borrowings = cursor.fetchone()[0]  # Extract the count from the query result
-
-    # Count the number of books currently borrowed (not yet returned) by the member
-    cursor.execute('''
-    SELECT COUNT(*) FROM borrowings
-    WHERE member = ? AND end_date IS NULL
-    ''', (email,))
-    current_borrowings = cursor.fetchone()[0]  # Extract the count from the query result
+    name, member_email, byear, previous_borrowings, current_borrowings, overdue_borrowings, unpaid_penalties_count, total_debt = summary
 
-    # Count the number of books that are currently borrowed and overdue
-    cursor.execute('''
-    SELECT COUNT(*) FROM borrowings
-    WHERE member = ? AND end_date IS NULL AND julianday('now') - julianday(start_date) > 20
-    ''', (email,))
-    overdue_borrowings = cursor.fetchone()[0]  # Extract the count from the query result
+    # Print their name, email, and birth year
+    print(f"Personal Information:\nName: {name}\nEmail: {member_email}\nBirth Year: {byear}\n")
 
     # Print the counts of previous, current, and overdue borrowings
     print(f"Borrowing Counts:\nPrevious Borrowings: {previous_borrowings}\nCurrent Borrowings: {current_borrowings}\nOverdue Borrowings: {overdue_borrowings}\n")
 
-    # Fetch and display penalty information related to unpaid penalties for the member
-
-    # Join the 'penalties' and 'borrowings' tables to find penalties associated with the member's borrowings
-    # that have not been fully paid. Calculate the count of such penalties and the total unpaid amount.
-    cursor.execute('''
-    SELECT COUNT(*), SUM(amount - IFNULL(paid_amount, 0)) AS total_debt
-    FROM penalties p
-    JOIN borrowings b ON p.bid = b.bid
-    WHERE b.member = ? AND amount > IFNULL(paid_amount, 0)
-    ''', (email,))
-    penalties = cursor.fetchone()  # Retrieve the results: count of unpaid penalties and total debt
-    unpaid_penalties_count = penalties[0]  # Extract the count of unpaid penalties
-    total_debt = penalties[1] if penalties[1] is not None else 0.0  # Extract the total debt, defaulting to 0 if None
-
     # Print the count of unpaid penalties and the total unpaid amount
     print(f"Penalty Information:\nNumber of Unpaid Penalties: {unpaid_penalties_count}\nTotal Debt Amount: ${total_debt:.2f}")
 
@@ -154,21 +672,12 @@ def get_member_profile(email):
 #2
 def return_book(email):
     print("\nReturning a Book:")
-    global connection, cursor  # Accesses the global database connection and cursor for SQL execution
 
     today = datetime.now().date()  # Gets today's date
-    deadline_days = 20  # Sets the borrowing deadline as 20 days from the start date
+    deadline_days = LOAN_PERIOD_DAYS  # Sets the borrowing deadline as LOAN_PERIOD_DAYS days from the start date
 
     # Retrieves borrowing information for the user's currently borrowed books that haven't been returned yet
-    cursor.execute('''
-    SELECT b.bid, bk.title, b.start_date, 
-           (julianday(?) - julianday(b.start_date)) - ? AS overdue_days,
-           DATE(julianday(b.start_date) + ?) AS return_deadline
-    FROM borrowings b
-    JOIN books bk ON b.book_id = bk.book_id
-    WHERE b.member = ? AND b.end_date IS NULL''', (today, deadline_days, deadline_days, email,))
-
-    borrowings = cursor.fetchall()  # Fetches all records matching the query
+    borrowings = get_open_borrowings(email, today, deadline_days)
     
     # Checks if there are no books to return and exits if true
     if not borrowings:
@@ -178,7 +687,6 @@ def return_book(email):
     # Lists the user's current borrowings
     print("Current Borrowings:")
     for borrowing in borrowings:
-        overdue_days = borrowing[3] if borrowing[3] > 0 else 0  # Calculates overdue days, if any
         # Prints each borrowing's details, including the return deadline
         print(f"Borrowing ID: {borrowing[0]}, Title: {borrowing[1]}, Start Date: {borrowing[2]}, Return Deadline: {borrowing[4]}")
 
@@ -189,25 +697,22 @@ def return_book(email):
         print("Invalid Borrowing ID.")  # Error message for invalid ID
         return
     
-    # Updates the borrowing record to set the end_date, marking the book as returned
-    cursor.execute('UPDATE borrowings SET end_date = ? WHERE bid = ? AND member = ? AND end_date IS NULL', (today, bid, email.lower(),))
-    connection.commit()  # Commits the transaction to the database
+    # Marks the book as returned and applies a penalty if it is late, in one transaction
+    overdue_days = record_return(email, bid, today, deadline_days)
+    if overdue_days is None:
+        print("This book has already been returned.")
+        return
 
-    # Calculates overdue days and applies a penalty if the book is returned late
     if overdue_days > 0:
-        cursor.execute("SELECT MAX(pid) FROM penalties")  # Retrieves the highest penalty ID
-        max_pid_result = cursor.fetchone()
-        max_pid = max_pid_result[0] if max_pid_result else 0  # Determines the next penalty ID
-        new_pid = max_pid + 1
-        
-        penalty_amount = overdue_days  # Sets the penalty amount based on overdue days
-        # Inserts a new penalty record for the overdue book
-        cursor.execute('INSERT INTO penalties (pid, bid, amount, paid_amount) VALUES (?, ?, ?, ?)', (new_pid, bid, penalty_amount, 0,))
+        penalty_amount = overdue_days  # The penalty amount is based on overdue days
         # Informs the user about the applied penalty
         print(f"A penalty of ${penalty_amount:.2f} has been applied for {overdue_days} overdue days.")
     else:
         print("Book returned on time. No penalty applied.") 
 
+    # Suggests books that other members borrowed together with this one
+    show_related_books(selected_borrowing[5], selected_borrowing[1])
+
     # Offers the user to write a review for the returned book
     review_choice = input("Would you like to write a review for this book? (y/n): ").lower()
     if review_choice == 'y':
@@ -225,86 +730,348 @@ def return_book(email):
         review_text = input("Review: ")
         rdate = today.strftime('%Y-%m-%d')  # Gets the current date for the review
         
-        # Retrieves the book ID associated with the returned book
-        cursor.execute('SELECT book_id FROM borrowings WHERE bid = ?', (bid,))
-        fetch_result = cursor.fetchone()
-        book_id = fetch_result[0] if fetch_result else None
+        # The book ID associated with the returned book
+        book_id = selected_borrowing[5]
 
         if book_id:
-            # Retrieves the highest review ID to determine the next review ID
-            cursor.execute("SELECT MAX(rid) FROM reviews")
-            max_rid_result = cursor.fetchone()
-            max_rid = max_rid_result[0] if max_rid_result else 0
-            new_rid = max_rid + 1
-
             # Inserts the new review into the database
-            cursor.execute('INSERT INTO reviews (rid, book_id, member, rating, rtext, rdate) VALUES (?, ?, ?, ?, ?, ?)', 
-                           (new_rid, book_id, email, rating, review_text, rdate,))
+            add_review(email, book_id, rating, review_text, rdate)
             print("Review submitted.")  # Confirms the review submission
-            connection.commit()  # Commits the transaction
         else:
             print("Error: Book ID could not be found for this borrowing.") 
 
 
+OPEN_BORROWINGS_QUERY = '''
+SELECT b.bid, bk.title, b.start_date,
+       (julianday(?) - julianday(b.start_date)) - ? AS overdue_days,
+       DATE(julianday(b.start_date) + ?) AS return_deadline,
+       b.book_id
+FROM borrowings b
+JOIN books bk ON b.book_id = bk.book_id
+WHERE b.member = ? AND b.end_date IS NULL
+'''
+
+
+def get_open_borrowings(email, today, deadline_days=LOAN_PERIOD_DAYS):
+    """Return (bid, title, start_date, overdue_days, return_deadline, book_id) for each book the member still has."""
+    with pool.reader() as cursor:
+        cursor.execute(OPEN_BORROWINGS_QUERY, (today, deadline_days, deadline_days, email,))
+        return cursor.fetchall()
+
+
+def find_open_borrowing(email, bid):
+    """Return the book_id of the member's borrowing 'bid' if it has not been returned yet, otherwise None."""
+    with pool.reader() as cursor:
+        cursor.execute('SELECT book_id FROM borrowings WHERE bid = ? AND member = ? AND end_date IS NULL', (bid, email))
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def record_return(email, bid, today, deadline_days=LOAN_PERIOD_DAYS):
+    """
+    Set the end_date of the member's open borrowing 'bid' and record a penalty if it is overdue, atomically.
+    Returns the number of overdue days (0 when on time), or None if there was no open borrowing to return.
+    If assess_penalties() already charged this borrowing while it was open, that penalty is brought up to the
+    final amount; otherwise a new one is inserted, its id assigned by SQLite while the write lock is held.
+    """
+    returned = run_write(close_borrowing, email, bid, today, deadline_days)
+    if returned is None:
+        return None
+    overdue_days, book_id = returned
+    invalidate_member_summary(email)
+    invalidate_book_searches(book_id)
+    return overdue_days
+
+
+CLOSE_BORROWING = 'UPDATE borrowings SET end_date = ? WHERE bid = ? AND member = ? AND end_date IS NULL'
+
+
+def close_borrowing(cursor, email, bid, today, deadline_days):
+    """The writes of record_return(); returns (overdue days, book_id), or None if there was nothing to return."""
+    cursor.execute(CLOSE_BORROWING, (today, bid, email))
+    if cursor.rowcount == 0:
+        return None
+
+    cursor.execute('SELECT (julianday(?) - julianday(start_date)) - ?, book_id FROM borrowings WHERE bid = ?', (today, deadline_days, bid))
+    overdue_days, book_id = cursor.fetchone()
+    overdue_days = max(overdue_days or 0, 0)
+    if overdue_days > 0:
+        # Raises the penalty already assessed for this borrowing, or inserts a new penalty record for the overdue book
+        cursor.execute('''
+            UPDATE penalties SET amount = MAX(amount, ?)
+            WHERE pid = (SELECT MAX(pid) FROM penalties WHERE bid = ?)
+        ''', (overdue_days, bid))
+        if cursor.rowcount == 0:
+            cursor.execute('INSERT INTO penalties (bid, amount, paid_amount) VALUES (?, ?, ?)', (bid, overdue_days, 0))
+    return overdue_days, book_id
+
+
+def add_review(email, book_id, rating, review_text, rdate):
+    """Insert a review and return its id, which SQLite assigns (rid is an INTEGER PRIMARY KEY)."""
+    rid = run_write(insert_review, email, book_id, rating, review_text, rdate)
+    invalidate_book_searches(book_id)
+    return rid
+
+
+def insert_review(cursor, email, book_id, rating, review_text, rdate):
+    cursor.execute('INSERT INTO reviews (book_id, member, rating, rtext, rdate) VALUES (?, ?, ?, ?, ?)',
+                   (book_id, email, rating, review_text, rdate))
+    return cursor.lastrowid
+
+
 
 
 
 #3
-def search_and_borrow_books(cursor, email):
-    """Allows users to search for books based on a keyword and borrow an available one, with unique bid assignment."""
-    
-    # Prompt the user for a keyword to find books by title or author
-    keyword = input("Enter a keyword to search for books (title or author): ").strip().lower()
-    
-    # Initialize variables for pagination
-    page = 0
-    page_size = 5
-    
-    while True:
-        offset = page * page_size  # Calculate offset based on current page
-        
-        # SQL query to fetch books matching the keyword with pagination
-        query = '''
-        SELECT * FROM (
-            SELECT b.book_id, b.title, b.author, b.pyear,
-                   IFNULL(AVG(r.rating), 'N/A') AS avg_rating,  -- Calculate the average rating, default to 'N/A'
-                   (CASE WHEN EXISTS(SELECT 1 FROM borrowings WHERE book_id = b.book_id AND end_date IS NULL) THEN 'On borrow' ELSE 'Available' END) AS status,
-                   1 AS sort_order  -- Priority for title matches
-            FROM books b
-            LEFT JOIN reviews r ON b.book_id = r.book_id
-            WHERE LOWER(b.title) LIKE ?
-            GROUP BY b.book_id
-
-            UNION ALL
-            
-            SELECT b.book_id, b.title, b.author, b.pyear,
-                   IFNULL(AVG(r.rating), 'N/A') AS avg_rating,  -- Calculate the average rating for author matches
-                   (CASE WHEN EXISTS(SELECT 1 FROM borrowings WHERE book_id = b.book_id AND end_date IS NULL) THEN 'On borrow' ELSE 'Available' END) AS status,
-                   2 AS sort_order  -- Lower priority for author matches
-            FROM books b
-            LEFT JOIN reviews r ON b.book_id = r.book_id
-            WHERE LOWER(b.author) LIKE ? AND LOWER(b.title) NOT LIKE ?
-            GROUP BY b.book_id
-        ) ORDER BY sort_order, 
-                 CASE WHEN sort_order = 1 THEN LOWER(title)  -- Sort title matches by title
-                      WHEN sort_order = 2 THEN LOWER(author)  -- Sort author matches by author
-                 END
-        LIMIT ? OFFSET ?  -- Apply pagination limits
-        '''
-        
-        # Execute the query with formatted keywords for LIKE clauses and pagination parameters
+def fts_phrase(keyword):
+    # Quote the keyword as an FTS5 string so that operators and punctuation in it are matched literally
+    return '"' + keyword.replace('"', '""') + '"'
+
+
+def build_search_query(keyword):
+    """
+    Build the book search query for a lowercased keyword and return it with its parameters.
+    Title matches come first (sorted by title), then author-only matches (sorted by author).
+    Uses the FTS5 trigram index when it is available and the keyword is long enough to have a trigram,
+    otherwise falls back to scanning 'books' with LIKE.
+    """
+    if fts_enabled and len(keyword) >= 3:
+        phrase = fts_phrase(keyword)
+        title_match = 'b.book_id IN (SELECT rowid FROM books_fts WHERE books_fts MATCH ?)'
+        author_match = title_match  # Same shape, the MATCH expression selects the column
+        params = (f'title : {phrase}', f'author : {phrase} NOT title : {phrase}')
+    else:
         formatted_keyword = f'%{keyword}%'
-        cursor.execute(query, (formatted_keyword, formatted_keyword, formatted_keyword, page_size, offset))
+        title_match = 'LOWER(b.title) LIKE ?'
+        author_match = 'LOWER(b.author) LIKE ? AND LOWER(b.title) NOT LIKE ?'
+        params = (formatted_keyword, formatted_keyword, formatted_keyword)
+
+    query = f'''
+    SELECT * FROM (
+        SELECT b.book_id, b.title, b.author, b.pyear,
+               IFNULL(1.0 * s.rating_sum / NULLIF(s.rating_count, 0), 'N/A') AS avg_rating,  -- Average rating from the precomputed totals, default to 'N/A'
+               (CASE WHEN IFNULL(s.open_loans, 0) > 0 THEN 'On borrow' ELSE 'Available' END) AS status,
+               1 AS sort_order,  -- Priority for title matches
+               IFNULL(LOWER(b.title), '') AS sort_key  -- Title matches are sorted by title
+        FROM books b
+        LEFT JOIN book_stats s ON b.book_id = s.book_id
+        WHERE {title_match}
+
+        UNION ALL
         
-        books = cursor.fetchall()  # Fetch all matching books
-        
-        # Inform the user if no books were found or end pagination
-        if not books and page == 0:
-            print("No books found with that keyword.")
+        SELECT b.book_id, b.title, b.author, b.pyear,
+               IFNULL(1.0 * s.rating_sum / NULLIF(s.rating_count, 0), 'N/A') AS avg_rating,  -- Average rating for author matches
+               (CASE WHEN IFNULL(s.open_loans, 0) > 0 THEN 'On borrow' ELSE 'Available' END) AS status,
+               2 AS sort_order,  -- Lower priority for author matches
+               IFNULL(LOWER(b.author), '') AS sort_key  -- Author matches are sorted by author
+        FROM books b
+        LEFT JOIN book_stats s ON b.book_id = s.book_id
+        WHERE {author_match}
+    )
+    '''
+    return query, params
+
+
+# Optional cache of search result pages, enabled with LIBRARY_SEARCH_CACHE=1 (see search_cache.py). Pages are
+# dropped when a book they show is borrowed, returned or reviewed through this program; like the summary cache,
+# only enable it when no other process writes to the database.
+search_cache = SearchCache(int(os.environ.get('LIBRARY_SEARCH_CACHE_SIZE', 10000)),
+                           float(os.environ.get('LIBRARY_SEARCH_CACHE_TTL', 300))) \
+    if os.environ.get('LIBRARY_SEARCH_CACHE') == '1' else None
+
+
+def invalidate_book_searches(book_id):
+    """Forget the cached search pages showing a book after its availability or rating changed."""
+    if search_cache:
+        search_cache.invalidate_book(book_id)
+
+
+def search_books_page(keyword, after=None, page_size=5):
+    """
+    Fetch one page of search results for a lowercased keyword.
+    'after' is the cursor returned with the previous page (None for the first page); the page resumes right after
+    that row using the (sort_order, sort_key, book_id) ordering instead of re-reading the skipped rows with OFFSET.
+    Returns the list of books and the cursor for the next page, which is None when there are no more results.
+    """
+    keyword = keyword.strip().lower()
+    key = (keyword, tuple(after) if after else None, page_size)
+    if search_cache:
+        cached = search_cache.get(key)
+        if cached:
+            return cached
+        generation = search_cache.generation
+
+    query, params = build_search_query(keyword)
+    with pool.reader() as cursor:
+        if after is None:
+            cursor.execute(query + ' ORDER BY sort_order, sort_key, book_id LIMIT ?', params + (page_size,))
+        else:
+            # Row-value comparison resumes from the last row shown on the previous page
+            cursor.execute(query + ' WHERE (sort_order, sort_key, book_id) > (?, ?, ?) ORDER BY sort_order, sort_key, book_id LIMIT ?',
+                           params + tuple(after) + (page_size,))
+        books = cursor.fetchall()
+
+    # A short page means the results are exhausted, otherwise the last row becomes the cursor for the next page
+    next_cursor = (books[-1][6], books[-1][7], books[-1][0]) if len(books) == page_size else None
+    if search_cache:
+        search_cache.put(key, books, next_cursor, generation)
+    return books, next_cursor
+
+
+def iter_search_pages(keyword, page_size=5):
+    """
+    Generator yielding the search results for a lowercased keyword one page (list of books) at a time.
+    A reader connection is only held while a page is fetched, not while the caller looks at it.
+    """
+    after = None
+    while True:
+        books, after = search_books_page(keyword, after, page_size)
+        if books:
+            yield books
+        if after is None:
             return
-        elif not books:
-            print("No more books found.")
-            break
+
+
+# Typo-tolerant search: trigram index over the words of all titles and authors (see trigram_index.py), built in a
+# background thread (it takes seconds on a large catalog) and then kept up to date with the books added or edited
+# since it was last used. Until it is built, searches that find nothing get no suggestion.
+word_index = None
+word_index_marks = None  # (highest book_id, highest book_edits seq) the index has seen
+word_index_lock = threading.Lock()  # Held while the index is updated or searched, it is not safe to do both at once
+word_index_loading = None  # Pool the background build reads from, while it runs
+
+WORD_PATTERN = re.compile(r'[^\W_]+')  # Words as the unicode61 tokenizer of 'books_words' splits them
+SUGGESTIONS_PER_WORD = 3  # Most similar catalog words tried for each unknown word of a keyword
+MAX_SUGGESTION_CHECKS = 10  # Corrected keywords checked for results before giving up
+
+
+def book_words(rows):
+    """Return the set of lowercased words in (title, author) rows."""
+    words = set()
+    for title, author in rows:
+        words.update(WORD_PATTERN.findall(f'{title or ""} {author or ""}'.lower()))
+    return words
+
+
+def read_word_index_marks(cursor):
+    """Return (highest book_id, highest book_edits seq), the point up to which the word index has seen the books."""
+    cursor.execute('SELECT IFNULL(MAX(book_id), 0) FROM books')
+    last_book = cursor.fetchone()[0]
+    cursor.execute('SELECT IFNULL(MAX(seq), 0) FROM book_edits')
+    return last_book, cursor.fetchone()[0]
+
+
+def start_word_index_build():
+    """Start building the word index in a background thread, unless it is built or being built already."""
+    global word_index_loading
+    with word_index_lock:
+        if word_index is not None or word_index_loading is pool:
+            return
+        word_index_loading = pool
+    threading.Thread(target=build_word_index, args=(pool,), daemon=True).start()
+
+
+def build_word_index(building_pool):
+    """Read every catalog word and build the word index from them, without holding word_index_lock meanwhile."""
+    global word_index, word_index_marks, word_index_loading
+    try:
+        with building_pool.reader() as cursor:
+            # Read the marks first: a book added while the words are read is read again next time, never missed
+            marks = read_word_index_marks(cursor)
+            try:
+                cursor.execute('SELECT term FROM books_words_vocab')
+                words = [row[0] for row in cursor]
+            except sqlite3.OperationalError:
+                # No word-level FTS5 index in this SQLite build
+                cursor.execute('SELECT title, author FROM books')
+                words = book_words(cursor)
+        index = TrigramIndex(words)
+        with word_index_lock:
+            if building_pool is pool:  # Not connected to another database in the meantime
+                word_index, word_index_marks = index, marks
+    except sqlite3.ProgrammingError:
+        pass  # The database was closed while the words were read
+    finally:
+        with word_index_lock:
+            if word_index_loading is building_pool:
+                word_index_loading = None
+
+
+def get_word_index():
+    """
+    Return the word index after adding the words of the books added or edited since the last call, or None while
+    it is still being built (which this starts if needed). Words of deleted books and old titles stay in the
+    index; suggest_keyword() only suggests keywords that find books.
+    """
+    global word_index_marks
+    start_word_index_build()
+    with word_index_lock:
+        if word_index is None:
+            return None
+        with pool.reader() as cursor:
+            marks = read_word_index_marks(cursor)
+            if marks != word_index_marks:
+                seen_book, seen_edit = word_index_marks
+                cursor.execute('''
+                SELECT title, author FROM books
+                WHERE book_id > ? OR book_id IN (SELECT book_id FROM book_edits WHERE seq > ?)
+                ''', (seen_book, seen_edit))
+                word_index.add(book_words(cursor))
+                word_index_marks = marks
+        return word_index
+
+
+def keyword_has_results(keyword):
+    """Return whether searching for a lowercased keyword finds any book, without sorting the matches."""
+    with pool.reader() as cursor:
+        if fts_enabled and len(keyword) >= 3:
+            cursor.execute('SELECT 1 FROM books_fts WHERE books_fts MATCH ? LIMIT 1', (fts_phrase(keyword),))
+        else:
+            cursor.execute('SELECT 1 FROM books WHERE LOWER(title) LIKE ? OR LOWER(author) LIKE ? LIMIT 1',
+                           (f'%{keyword}%', f'%{keyword}%'))
+        return cursor.fetchone() is not None
+
+
+def suggest_keyword(keyword):
+    """
+    Correct a keyword that finds no books. Each word of three or more letters that appears in no title or author is
+    replaced by one of the catalog words most similar to it, trying the combinations in order of total similarity
+    until one finds books. Returns the corrected keyword, or None if no combination finds anything or the word index
+    is not built yet.
+    """
+    keyword = keyword.strip().lower()
+    index = get_word_index()
+    if index is None:
+        return None  # Still being built
+    spans, choices = [], []
+    with word_index_lock:  # Another thread's get_word_index() may be adding words to the index
+        for match in WORD_PATTERN.finditer(keyword):
+            word = match.group()
+            if len(word) >= 3 and word not in index:
+                # Past a few unknown words only the best match of each is tried, to keep the combinations few
+                similar = index.similar(word, SUGGESTIONS_PER_WORD if len(choices) < 4 else 1)
+                if similar:
+                    spans.append(match.span())
+                    choices.append(similar)
+    if not choices:
+        return None
+
+    combinations = sorted(itertools.product(*choices), key=lambda combination: -sum(score for score, _ in combination))
+    for combination in combinations[:MAX_SUGGESTION_CHECKS]:
+        suggestion = keyword
+        # Replace from the end so that the earlier spans stay valid
+        for (start, end), (_, word) in reversed(list(zip(spans, combination))):
+            suggestion = suggestion[:start] + word + suggestion[end:]
+        if keyword_has_results(suggestion):
+            return suggestion
+    return None
+
+
+def show_search_results(keyword, page_size):
+    """Print the results for a keyword page by page while the user asks for more; return the first book or None."""
+    first_book = None
+    for books in iter_search_pages(keyword, page_size):
+        first_book = first_book or books[0]
 
         # Display each book's details fetched from the database
         for book in books:
@@ -312,7 +1079,35 @@ def search_and_borrow_books(cursor, email):
 
         if len(books) < page_size or input("Show more results? (yes/no): ").lower() != 'yes':
             break
-        page += 1  # Increment page for next set of results, if user chooses to continue
+    else:
+        # The generator ran out of pages after showing some books
+        if first_book:
+            print("No more books found.")
+    return first_book
+
+
+def search_and_borrow_books(email):
+    """Allows users to search for books based on a keyword and borrow an available one, with unique bid assignment."""
+    
+    # Prompt the user for a keyword to find books by title or author
+    keyword = input("Enter a keyword to search for books (title or author): ").strip().lower()
+    
+    # Results are fetched one page at a time, each page resuming after the last book shown
+    page_size = 5
+    first_book = show_search_results(keyword, page_size)
+
+    if first_book is None:
+        # Nothing matches exactly: the keyword is probably misspelled, so search for the closest catalog words instead
+        suggestion = suggest_keyword(keyword)
+        if suggestion:
+            print(f"No books found for '{keyword}'. Showing results for '{suggestion}':")
+            first_book = show_search_results(suggestion, page_size)
+        if first_book is None:
+            print("No books found with that keyword.")
+            return
+
+    # Suggest books often borrowed together with the best match
+    show_related_books(first_book[0], first_book[1])
 
     # After displaying all search results, ask the user if they still want to borrow a book
     while True:  # Keep looping until a valid action is taken (either borrowing a book or deciding not to)
@@ -326,24 +1121,11 @@ def search_and_borrow_books(cursor, email):
                 print("Please enter a valid numeric Book ID.")
                 continue  # Prompt the user again for a valid book ID
             
-            # Check if the selected book is already on loan
-            cursor.execute("SELECT COUNT(*) FROM borrowings WHERE book_id = ? AND end_date IS NULL", (book_id,))
-            if cursor.fetchone()[0] > 0:
-                print("This book is currently on borrow and cannot be borrowed.")  # Notify the user if the book is unavailable
+            # Check availability and insert the borrowing in one transaction
+            new_bid = borrow_book(email, int(book_id))
+            if new_bid is None:
+                print("This book is currently on borrow or does not exist and cannot be borrowed.")  # Notify the user if the book is unavailable
             else:
-                # Query the current maximum bid value to ensure uniqueness for the new entry
-                cursor.execute("SELECT MAX(bid) FROM borrowings")
-                max_bid_row = cursor.fetchone()
-                max_bid = max_bid_row[0] if max_bid_row[0] is not None else 0
-                
-                # Calculate the new bid value by incrementing the current maximum by one
-                new_bid = max_bid + 1
-                
-                # Insert the new borrowing record with the unique bid, user email, and book ID
-                today = datetime.today().date()  # Get the current date for the start_date
-                cursor.execute("INSERT INTO borrowings (bid, member, book_id, start_date) VALUES (?, ?, ?, ?)", 
-                               (new_bid, email, book_id, today))
-                
                 print(f"You have successfully borrowed the book with borrowing ID: {new_bid}.")  # Confirm the successful borrowing
                 break  # Exit the loop after successfully borrowing a book
         elif borrow_decision == 'no':
@@ -354,20 +1136,66 @@ def search_and_borrow_books(cursor, email):
 
 
 
+def get_related_books(book_id, limit=3):
+    """Return (book_id, title, author) of the books most often borrowed by members who borrowed 'book_id'."""
+    if not related_books:
+        return []
+    similar = [other for other, _ in related_books.similar(book_id, limit)]
+    if not similar:
+        return []
+    with pool.reader() as cursor:
+        cursor.execute(f'SELECT book_id, title, author FROM books WHERE book_id IN ({", ".join("?" * len(similar))})', similar)
+        books = {book[0]: book for book in cursor.fetchall()}
+    return [books[other] for other in similar if other in books]  # Keep the order of similarity
+
+
+def show_related_books(book_id, title):
+    related = get_related_books(book_id)
+    if related:
+        print(f"Members who borrowed '{title}' also borrowed:")
+        for other_id, other_title, author in related:
+            print(f"  Book ID: {other_id}, Title: {other_title}, Author: {author}")
+
+
+def borrow_book(email, book_id):
+    """
+    Lend a book to a member if it exists and is not currently on loan.
+    The availability check and the insert are one statement inside a BEGIN IMMEDIATE transaction, and the
+    borrowings_open_loan index rejects a second open loan, so concurrent sessions can never lend the same book twice.
+    Returns the new borrowing id (assigned by SQLite, bid is an INTEGER PRIMARY KEY), or None if the book is unavailable.
+    """
+    today = datetime.today().date()  # Get the current date for the start_date
+    new_bid = run_write(insert_borrowing, email, book_id, today)
+    if new_bid is None:
+        return None
+    invalidate_member_summary(email)
+    invalidate_book_searches(book_id)
+    return new_bid
+
+
+INSERT_BORROWING = '''
+INSERT INTO borrowings (member, book_id, start_date)
+SELECT ?, book_id, ? FROM books
+WHERE book_id = ? AND NOT EXISTS (SELECT 1 FROM borrowings WHERE book_id = ? AND end_date IS NULL)
+'''
+
+
+def insert_borrowing(cursor, email, book_id, today):
+    """The write of borrow_book(); returns the new bid, or None if the book does not exist or is on loan."""
+    try:
+        cursor.execute(INSERT_BORROWING, (email, today, book_id, book_id))
+    except sqlite3.IntegrityError:
+        return None  # Lost the race to another session lending the same book
+    return cursor.lastrowid if cursor.rowcount == 1 else None
+
 
 #4
 def pay_penalty(email):
     # Inform the user about the unpaid penalties section
     print("\nYour Unpaid Penalties:")
 
-    # Retrieve all unpaid penalties for the user, ensuring the email check is case-insensitive
-    cursor.execute('''
-        SELECT pid, bid, amount, COALESCE(paid_amount, 0) AS paid_amount
-        FROM penalties
-        WHERE bid IN (SELECT bid FROM borrowings WHERE member = ?) AND COALESCE(paid_amount, 0) < amount
-    ''', (email,))
-
-    penalties = cursor.fetchall()
+    # Retrieve all unpaid penalties for the user
+    penalties = get_unpaid_penalties(email)
 
     # If there are no penalties, inform the user and exit the function
     if not penalties:
@@ -389,6 +1217,7 @@ def pay_penalty(email):
     if not selected_penalty:
         print("Invalid Penalty ID.")
         return
+    unpaid_amount = selected_penalty[2] - selected_penalty[3]  # Remaining unpaid amount of the selected penalty
 
     # Prompt the user to enter an amount to pay towards the selected penalty
     while True:
@@ -402,38 +1231,249 @@ def pay_penalty(email):
             print("Please enter a numerical value.")
 
     # Update the penalty record with the new payment amount
-    new_paid_amount = selected_penalty[3] + payment
-    cursor.execute('''
-        UPDATE penalties
-        SET paid_amount = ?
-        WHERE pid = ?
-    ''', (new_paid_amount, pid))
-
-    # Commit the changes to the database
-    connection.commit()
+    if not record_payment(email, pid, payment):
+        print("This penalty has changed since it was listed, please try again.")
+        return
 
     # Inform the user of the successful payment and the remaining unpaid amount
     print(f"You have paid ${payment:.2f} towards Penalty ID {pid}. Remaining Unpaid Amount: ${unpaid_amount - payment:.2f}")
 
     # Recalculate and display the updated total debt amount for user feedback
-    cursor.execute('''
-        SELECT SUM(amount - COALESCE(paid_amount, 0))
-        FROM penalties
-        WHERE bid IN (SELECT bid FROM borrowings WHERE member = ?)
-    ''', (email,))
-    updated_total_debt = cursor.fetchone()[0] or 0.0
+    summary = get_member_summary(email)
+    updated_total_debt = summary[7] if summary else 0.0
     print(f"Your updated total debt amount: ${updated_total_debt:.2f}")
 
 
+UNPAID_PENALTIES_QUERY = '''
+SELECT pid, bid, amount, COALESCE(paid_amount, 0) AS paid_amount
+FROM penalties
+WHERE bid IN (SELECT bid FROM borrowings WHERE member = ?) AND COALESCE(paid_amount, 0) < amount
+'''
+
+
+def get_unpaid_penalties(email):
+    """Return (pid, bid, amount, paid_amount) for each of the member's penalties that is not fully paid."""
+    with pool.reader() as cursor:
+        cursor.execute(UNPAID_PENALTIES_QUERY, (email,))
+        return cursor.fetchall()
+
+
+def record_payment(email, pid, payment):
+    """
+    Add a payment to one of the member's penalties. The amount is added to the stored paid_amount in a single
+    UPDATE that also checks it does not exceed the penalty, so concurrent payments cannot overwrite each other.
+    Returns True if the payment was recorded.
+    """
+    recorded = run_write(apply_payment, email, pid, payment)
+    invalidate_member_summary(email)
+    return recorded
+
+
+APPLY_PAYMENT = '''
+UPDATE penalties
+SET paid_amount = COALESCE(paid_amount, 0) + ?
+WHERE pid = ? AND COALESCE(paid_amount, 0) + ? <= amount
+  AND EXISTS (SELECT 1 FROM borrowings b WHERE b.bid = penalties.bid AND b.member = ?)  -- One lookup of this bid, not a list of all the member's bids
+'''
+
+
+def apply_payment(cursor, email, pid, payment):
+    cursor.execute(APPLY_PAYMENT, (payment, pid, payment, email))
+    return cursor.rowcount == 1
+
+
+ASSESS_CHUNK_BIDS = 100000  # Borrowing ids handled per transaction by assess_penalties()
+
+# Overdue days of each borrowing in a bid range: up to the return date for closed borrowings, up to today for
+# open ones. Shared by the two statements of assess_penalties(); parameters are (today, loan days, low, high).
+OVERDUE_BORROWINGS = '''
+SELECT bid, end_date, julianday(IFNULL(end_date, ?)) - julianday(start_date) - ? AS overdue_days
+FROM borrowings
+WHERE bid > ? AND bid <= ?
+'''
+
+
+def assess_penalties(cursor, today, loan_days=LOAN_PERIOD_DAYS, chunk_bids=ASSESS_CHUNK_BIDS):
+    """
+    Charge every overdue borrowing, open or closed, one dollar per overdue day, walking the borrowings in bid order
+    with two set-based statements per chunk of 'chunk_bids' ids:
+    - open borrowings that were already charged get their latest penalty raised to the days overdue so far,
+    - overdue borrowings without any penalty get one inserted.
+    Running it again on the same day changes nothing. Each chunk commits together with the last processed bid
+    (the watermark in penalty_assessment), so an interrupted run picks up where it stopped.
+    Returns (penalties inserted, penalties raised).
+    """
+    cursor.execute('SELECT last_bid FROM penalty_assessment WHERE id = 1')
+    low = cursor.fetchone()[0]
+    cursor.execute('SELECT IFNULL(MAX(bid), 0) FROM borrowings')
+    max_bid = cursor.fetchone()[0]
+    inserted = raised = 0
+
+    while low < max_bid:
+        high = low + chunk_bids
+        params = (today, loan_days, low, high)
+        with immediate_transaction(cursor):
+            cursor.execute(f'''
+            UPDATE penalties SET amount = o.overdue_days
+            FROM ({OVERDUE_BORROWINGS}) AS o
+            WHERE penalties.bid = o.bid AND o.end_date IS NULL AND o.overdue_days > penalties.amount
+              AND penalties.pid = (SELECT MAX(pid) FROM penalties p WHERE p.bid = o.bid)
+            ''', params)
+            raised += cursor.rowcount
+            cursor.execute(f'''
+            INSERT INTO penalties (bid, amount, paid_amount)
+            SELECT o.bid, o.overdue_days, 0 FROM ({OVERDUE_BORROWINGS}) AS o
+            WHERE o.overdue_days > 0 AND NOT EXISTS (SELECT 1 FROM penalties p WHERE p.bid = o.bid)
+            ''', params)
+            inserted += cursor.rowcount
+            cursor.execute('UPDATE penalty_assessment SET last_bid = ? WHERE id = 1', (min(high, max_bid),))
+        low = high
+
+    # The run is complete: the next one starts again from the first borrowing
+    cursor.execute('UPDATE penalty_assessment SET last_bid = 0 WHERE id = 1')
+    cursor.connection.commit()
+    invalidate_member_summary()  # Debts of many members may have changed
+    return inserted, raised
+
+
+ARCHIVE_AFTER_DAYS = 365  # Default age, counted from the return date, at which archive_borrowings() moves a loan
+ARCHIVE_CHUNK_BIDS = 50000  # Borrowing ids handled per transaction by archive_borrowings()
+
+
+def archive_borrowings(cursor, cutoff, chunk_bids=ARCHIVE_CHUNK_BIDS):
+    """
+    Move the borrowings returned before 'cutoff' (a 'YYYY-MM-DD' date) to borrowings_archive, and their penalties to
+    penalties_archive, one transaction per chunk of 'chunk_bids' borrowing ids, so that 'borrowings' only keeps the
+    loans the member-facing queries work with. A borrowing stays where it is while:
+    - one of its penalties is not fully paid, so that penalty and payment queries never need the archive,
+    - it was returned late but has no penalty yet, so that assess_penalties() can still charge it,
+    - it holds the highest bid, or one of its penalties the highest pid, since SQLite hands out the next id after
+      the highest one still in the table and an id must never be reused for a new loan or penalty.
+    Returns the number of borrowings and penalties archived.
+    """
+    cursor.execute('SELECT IFNULL(MAX(bid), 0) FROM borrowings')
+    max_bid = cursor.fetchone()[0]
+    cursor.execute('SELECT IFNULL(MAX(pid), 0) FROM penalties')
+    max_pid = cursor.fetchone()[0]
+    borrowings_moved = penalties_moved = 0
+
+    # Bids moved by the current chunk: the copies and the deletes work from exactly this list
+    cursor.execute('CREATE TEMP TABLE IF NOT EXISTS archive_chunk (bid INTEGER PRIMARY KEY)')
+    for low in range(0, max_bid, chunk_bids):
+        chunk = (low, low + chunk_bids)
+        with immediate_transaction(cursor):
+            cursor.execute('DELETE FROM archive_chunk')
+            # A bid or pid already in the archive (possible after a bulk import) is left where it is rather than
+            # clash with the archived row
+            cursor.execute('''
+            INSERT INTO archive_chunk (bid)
+            SELECT bid FROM borrowings b
+            WHERE bid > ? AND bid <= ? AND bid < ? AND end_date IS NOT NULL AND end_date < ?
+              AND NOT EXISTS (SELECT 1 FROM penalties p
+                              WHERE p.bid = b.bid AND (IFNULL(p.paid_amount, 0) < p.amount OR p.pid >= ?))
+              AND (julianday(end_date) - julianday(start_date) <= ?
+                   OR EXISTS (SELECT 1 FROM penalties p WHERE p.bid = b.bid))
+              AND NOT EXISTS (SELECT 1 FROM borrowings_archive a WHERE a.bid = b.bid)
+              AND NOT EXISTS (SELECT 1 FROM penalties p JOIN penalties_archive pa ON pa.pid = p.pid WHERE p.bid = b.bid)
+            ''', chunk + (max_bid, cutoff, max_pid, LOAN_PERIOD_DAYS))
+
+            chunk_bids_query = 'SELECT bid FROM archive_chunk'
+            cursor.execute(f'''
+            INSERT INTO borrowings_archive (bid, member, book_id, start_date, end_date)
+            SELECT bid, member, book_id, start_date, end_date FROM borrowings WHERE bid IN ({chunk_bids_query})
+            ''')
+            borrowings_moved += cursor.rowcount
+            cursor.execute(f'''
+            INSERT INTO penalties_archive (pid, bid, amount, paid_amount)
+            SELECT pid, bid, amount, paid_amount FROM penalties WHERE bid IN ({chunk_bids_query})
+            ''')
+            penalties_moved += cursor.rowcount
+            cursor.execute(f'DELETE FROM penalties WHERE bid IN ({chunk_bids_query})')
+            cursor.execute(f'DELETE FROM borrowings WHERE bid IN ({chunk_bids_query})')
+    return borrowings_moved, penalties_moved
+
+
     
+def run_command(command, db_path, argument=None):
+    """Run a maintenance command against the database instead of starting the interactive menu."""
+    connect_to_database(db_path)
+    if command == "rebuild-stats":
+        with pool.writer() as cursor:
+            rebuild_book_stats(cursor)
+        print("Book statistics rebuilt.")
+    elif command == "verify-stats":
+        with pool.reader() as cursor:
+            mismatched = verify_book_stats(cursor)
+        if mismatched:
+            print(f"Book statistics are out of date for {len(mismatched)} book(s): {mismatched[:20]}")
+            close_database()
+            sys.exit(1)
+        print("Book statistics are consistent.")
+    elif command == "assess-penalties":
+        with pool.writer() as cursor:
+            inserted, raised = assess_penalties(cursor, str(datetime.now().date()))
+        print(f"Penalties assessed with a {LOAN_PERIOD_DAYS}-day loan period: {inserted} new, {raised} raised.")
+    elif command == "archive":
+        days = int(argument) if argument else ARCHIVE_AFTER_DAYS
+        cutoff = str(datetime.now().date() - timedelta(days=days))
+        with pool.writer() as cursor:
+            borrowings_moved, penalties_moved = archive_borrowings(cursor, cutoff)
+        print(f"Archived {borrowings_moved} borrowings returned before {cutoff} and {penalties_moved} penalties.")
+    elif command in ("build-recommendations", "refresh-recommendations"):
+        path = recommendations.recommendations_path(db_path)
+        with pool.reader() as cursor:
+            if command == "build-recommendations":
+                rows = recommendations.build(cursor, path)
+                print(f"Recommendations built for {rows - 1} book ids in {path}.")
+            else:
+                rows = recommendations.refresh(cursor, path)
+                print(f"Recommendations recomputed for {rows} books in {path}.")
+    elif command == "query-report":
+        query_stats.print_report(db_path)
+    elif command == "check-plans":
+        with pool.reader() as cursor:
+            full_scans = check_query_plans(cursor)
+        for name, detail in full_scans:
+            print(f"Full table scan in {name}: {detail}")
+        if full_scans:
+            close_database()
+            sys.exit(1)
+        print(f"Schema version {SCHEMA_VERSION}: no hot query scans a whole table.")
+    else:
+        print(f"Unknown command: {command}")
+        close_database()
+        sys.exit(1)
+    close_database()
+
+
 def main():
+    if len(sys.argv) in (3, 4) and sys.argv[1] == "serve":
+        import server  # Only needed in server mode
+        server.main(sys.argv[2], int(sys.argv[3]) if len(sys.argv) == 4 else 8080)  # e.g. python your_script.py serve <dbname> 8080
+        return
+    if len(sys.argv) in (3, 4) and sys.argv[1] == "batch":
+        import batch  # Only needed in batch mode
+        batch.main(sys.argv[2], sys.argv[3] if len(sys.argv) == 4 else '-')  # e.g. python your_script.py batch <dbname> desk.jsonl
+        return
+    if len(sys.argv) >= 3 and sys.argv[1] == "import":
+        import bulk_import  # Only needed for bulk imports
+        bulk_import.main(sys.argv[2], sys.argv[3:])  # e.g. python your_script.py import <dbname> books books.csv
+        return
+    if len(sys.argv) == 3 or (len(sys.argv) == 4 and sys.argv[1] == "archive"):
+        run_command(*sys.argv[1:])  # e.g. python your_script.py verify-stats <dbname>
+        return
     if len(sys.argv) != 2:
-        print("Usage: python your_script.py <dbname>")
+        print("Usage: python your_script.py [rebuild-stats|verify-stats|check-plans|assess-penalties|query-report|build-recommendations|refresh-recommendations] <dbname>\n"
+              "       python your_script.py archive <dbname> [days]\n"
+              "       python your_script.py serve <dbname> [port]\n"
+              "       python your_script.py batch <dbname> [operations.jsonl]\n"
+              "       python your_script.py import <dbname> <table> <file> [<table> <file> ...]")
         sys.exit(1)
 
     db_path = sys.argv[1]
 
     connect_to_database(db_path)  # Call the function to establish a connection to the specified SQLite database.
+    start_word_index_build()  # Ready for the first misspelled search, without making anyone wait for it
     user_email = None  # Initially, no user is logged in.
 
     while True:
@@ -444,7 +1484,7 @@ def main():
             elif user_option == "2":
                 return_book(user_email)  # Return a book
             elif user_option == "3":
-                search_and_borrow_books(cursor, user_email) # Search and possibly borrow books
+                search_and_borrow_books(user_email) # Search and possibly borrow books
             elif user_option == "4":
                 pay_penalty(user_email)  # Pay a penalty
             elif user_option == "5":
@@ -469,7 +1509,7 @@ def main():
             else:
                 print("Invalid choice. Please try again.\n")
     
-    connection.close()
+    close_database()  # Commit queued writes and close every connection, refreshing the planner statistics gathered by ANALYZE
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
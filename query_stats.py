@@ -0,0 +1,236 @@
+"""
+Optional instrumentation of the SQL statements run through the connection pool.
+
+Enabled with LIBRARY_QUERY_STATS=1. Every statement is then timed (execution plus fetching its rows) and counted
+under a fingerprint of its text, in which literals and whitespace are normalised so that one query shape is one
+entry. Statements slower than LIBRARY_SLOW_QUERY_MS (default 50) are appended to <dbname>.slow-queries.jsonl
+together with their EXPLAIN QUERY PLAN; parameter values are never logged, as they include passwords.
+
+The totals are added to <dbname>.query-stats.json when the pool is closed, so that they accumulate over runs and
+processes; 'python miniproject.py query-report <dbname>' prints the statements that took the most time. The file
+is updated under a lock on <dbname>.query-stats.json.lock, which is not available on Windows: there, processes
+closing their pools at the same moment can lose each other's totals.
+
+When disabled the pool hands out plain sqlite3 cursors and nothing here runs.
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from functools import lru_cache
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows: the stats file is updated without a lock between processes
+
+SLOW_QUERY_MS = float(os.environ.get('LIBRARY_SLOW_QUERY_MS', 50))
+REPORT_STATEMENTS = 20  # Statements listed by print_report()
+
+
+def enabled():
+    return os.environ.get('LIBRARY_QUERY_STATS') == '1'
+
+
+def stats_path(db_path):
+    return db_path + '.query-stats.json'
+
+
+def slow_log_path(db_path):
+    return db_path + '.slow-queries.jsonl'
+
+
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive lock on 'path' (created if needed) against other processes."""
+    with open(path, 'a') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)  # Released when the file is closed
+        yield
+
+
+@lru_cache(maxsize=1024)
+def fingerprint(sql):
+    """Normalise a statement so that the same query with other literals, spacing or list lengths counts as one."""
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)  # String literals
+    sql = re.sub(r'--[^\n]*', ' ', sql)  # Comments
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)  # Numbers
+    sql = re.sub(r'\s+', ' ', sql).strip()
+    return re.sub(r'\(\?(?:, ?\?)+\)', '(?, ...)', sql)  # IN lists and VALUES rows of any length
+
+
+class QueryStats:
+    """Per-fingerprint call counts, total and maximum time and row counts, shared by every pooled connection."""
+
+    def __init__(self, db_path, slow_ms=SLOW_QUERY_MS):
+        self.stats_path = stats_path(db_path)
+        self.log_path = slow_log_path(db_path)
+        self.slow_ms = slow_ms
+        self.statements = {}  # Fingerprint -> [calls, total seconds, max seconds, rows]
+        self.plans = {}  # Fingerprint -> query plan of its first slow execution
+        self.lock = threading.Lock()
+
+    def cursor(self, connection):
+        """Cursor factory for connection.cursor()."""
+        return InstrumentedCursor(connection, self)
+
+    def record(self, connection, sql, params, seconds, rows):
+        key = fingerprint(sql)
+        with self.lock:
+            entry = self.statements.get(key)
+            if entry is None:
+                entry = self.statements[key] = [0, 0.0, 0.0, 0]
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+            entry[3] += rows
+        if seconds * 1000 >= self.slow_ms:
+            self.log_slow(connection, key, sql, params, seconds, rows)
+
+    def log_slow(self, connection, key, sql, params, seconds, rows):
+        """Append a slow statement to the slow-query log, with its plan (captured once per fingerprint)."""
+        plan = self.plans.get(key)
+        if plan is None and params is not None:
+            try:
+                plan = [row[3] for row in connection.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+            except sqlite3.Error:
+                plan = []  # Statements such as BEGIN or PRAGMA have no plan
+            self.plans[key] = plan
+        entry = {'time': datetime.now().isoformat(timespec='milliseconds'), 'ms': round(seconds * 1000, 3),
+                 'rows': rows, 'statement': key, 'plan': plan or []}
+        with self.lock, open(self.log_path, 'a') as log:
+            log.write(json.dumps(entry) + '\n')
+
+    def save(self):
+        """Add the totals collected so far to the stats file and start counting from zero."""
+        # Another process closing its pool at the same time would otherwise read the file before this one writes it
+        with self.lock, file_lock(self.stats_path + '.lock'):
+            saved = load_stats(self.stats_path)
+            for key, (calls, seconds, slowest, rows) in self.statements.items():
+                entry = saved.setdefault(key, {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'rows': 0})
+                entry['calls'] += calls
+                entry['seconds'] += seconds
+                entry['max_seconds'] = max(entry['max_seconds'], slowest)
+                entry['rows'] += rows
+                if self.plans.get(key):
+                    entry['plan'] = self.plans[key]
+            self.statements.clear()
+
+            # Write a new file and rename it over the old one, so that a crash never leaves half a file behind
+            with open(self.stats_path + '.tmp', 'w') as output:
+                json.dump(saved, output, indent=1)
+            os.replace(self.stats_path + '.tmp', self.stats_path)
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """
+    Cursor that reports every statement to a QueryStats once it is finished: when its rows have all been fetched,
+    or when the cursor runs its next statement or is closed.
+    """
+
+    def __init__(self, connection, stats):
+        super().__init__(connection)
+        self.stats = stats
+        self.pending = None  # [sql, params, seconds, rows] of the statement whose rows are being fetched
+
+    def execute(self, sql, parameters=()):
+        self.finish()
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.pending = [sql, parameters, time.perf_counter() - start, max(self.rowcount, 0)]
+            if self.description is None:
+                self.finish()  # Not a query, there is nothing to fetch
+
+    def executemany(self, sql, seq_of_parameters):
+        self.finish()
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self.pending = [sql, None, time.perf_counter() - start, max(self.rowcount, 0)]
+            self.finish()
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self.fetched(time.perf_counter() - start, row is not None, row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        start = time.perf_counter()
+        rows = super().fetchmany(size)
+        self.fetched(time.perf_counter() - start, len(rows), len(rows) < size)
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self.fetched(time.perf_counter() - start, len(rows), True)
+        return rows
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self.fetched(time.perf_counter() - start, 0, True)
+            raise
+        self.fetched(time.perf_counter() - start, 1, False)
+        return row
+
+    def close(self):
+        self.finish()
+        super().close()
+
+    def fetched(self, seconds, rows, done):
+        if self.pending:
+            self.pending[2] += seconds
+            self.pending[3] += rows
+            if done:
+                self.finish()
+
+    def finish(self):
+        if self.pending:
+            sql, params, seconds, rows = self.pending
+            self.pending = None
+            self.stats.record(self.connection, sql, params, seconds, rows)
+
+
+def load_stats(path):
+    try:
+        with open(path) as source:
+            return json.load(source)
+    except FileNotFoundError:
+        return {}
+
+
+def print_report(db_path, limit=REPORT_STATEMENTS):
+    """Print the statements that took the most total time, with their call counts, latency and rows."""
+    statements = load_stats(stats_path(db_path))
+    if not statements:
+        print(f"No statement statistics for {db_path}; run the program with LIBRARY_QUERY_STATS=1 first.")
+        return
+
+    total = sum(entry['seconds'] for entry in statements.values())
+    hottest = sorted(statements.items(), key=lambda item: item[1]['seconds'], reverse=True)[:limit]
+    print(f"{'share':>6} {'calls':>9} {'total ms':>10} {'mean ms':>8} {'max ms':>8} {'rows/call':>9}  statement")
+    for key, entry in hottest:
+        print(f"{entry['seconds'] / total * 100 if total else 0:>5.1f}% {entry['calls']:>9} "
+              f"{entry['seconds'] * 1000:>10.1f} {entry['seconds'] / entry['calls'] * 1000:>8.3f} "
+              f"{entry['max_seconds'] * 1000:>8.2f} {entry['rows'] / entry['calls']:>9.1f}  {key[:160]}")
+        for step in entry.get('plan', []):
+            print(f"{'':>55}plan: {step}")
+
+    try:
+        with open(slow_log_path(db_path)) as log:
+            slow = sum(1 for _ in log)
+        print(f"{slow} slow statements logged in {slow_log_path(db_path)}")
+    except FileNotFoundError:
+        pass
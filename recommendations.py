@@ -0,0 +1,265 @@
+"""
+"Members who borrowed this also borrowed" recommendations, precomputed into a file that is read through mmap.
+
+The build reads every (member, book) pair from borrowings, archived borrowings and reviews into compressed sparse
+row arrays, one listing each member's books and one listing each book's members. For every book it then counts how
+often each other book shares a member with it (collections.Counter over array slices, so the counting runs in C)
+and keeps the TOP_K books with the highest cosine similarity: shared members / sqrt(members of one * members of
+the other). Members with more than MAX_MEMBER_BOOKS books are left out: they relate everything to everything and
+would dominate the cost.
+
+File layout (native byte order): a header with the format magic, TOP_K, the number of rows and the highest bid and
+rid included, then one fixed-size row per book_id (row 0 unused) holding TOP_K int32 book ids followed by TOP_K
+float32 scores, zero-padded, and last the int32 member count of every book. A lookup is a slice of the mapped file
+at book_id * row size.
+
+refresh() only recomputes the rows of the books touched by borrowings and reviews added since the file was built:
+every book of the members who added them. It reads the pairs of those members, then of all the members of those
+books, which is all a row needs besides the member counts of the other books it relates to; those have not changed
+and come from the file. Scores in the rows that are not recomputed keep the member counts of the last build until
+the next full build.
+
+Both write a new file and rename it over the old one, so a process that has the file mapped keeps reading the
+version it opened, whole, until it connects again.
+"""
+import heapq
+import mmap
+import os
+import struct
+from array import array
+from collections import Counter
+from itertools import accumulate
+from operator import mul
+
+MAGIC = b'LIBREC02'
+HEADER = struct.Struct('=8sIqqq')  # magic, top k, rows, last bid, last rid
+HEADER_SIZE = 64
+TOP_K = 10
+MAX_MEMBER_BOOKS = 500
+BATCH_BOOKS = 10000  # Rows computed and written at a time
+BATCH_MEMBERS = 500  # Members or books per IN list when refresh() reads pairs
+
+PAIRS_QUERY = '''
+SELECT member, book_id FROM borrowings
+UNION SELECT member, book_id FROM borrowings_archive
+UNION SELECT member, book_id FROM reviews
+ORDER BY member
+'''
+
+# The same pairs restricted to a list of members or books, for refresh(); {0} is replaced by the list's placeholders
+MEMBER_PAIRS_QUERY = '''
+SELECT member, book_id FROM borrowings WHERE member IN ({0})
+UNION SELECT member, book_id FROM borrowings_archive WHERE member IN ({0})
+UNION SELECT member, book_id FROM reviews WHERE member IN ({0})
+'''
+BOOK_MEMBERS_QUERY = '''
+SELECT member FROM borrowings WHERE book_id IN ({0})
+UNION SELECT member FROM borrowings_archive WHERE book_id IN ({0})
+UNION SELECT member FROM reviews WHERE book_id IN ({0})
+'''
+
+
+def recommendations_path(db_path):
+    return db_path + '.recommendations'
+
+
+class Interactions:
+    """
+    Who borrowed or reviewed what, as two compressed sparse row structures over dense member numbers, built from
+    (member, book_id) pairs ordered by member.
+    """
+
+    def __init__(self, pairs, book_rows):
+        self.member_offsets = array('q', [0])  # Member number i has books member_books[offsets[i]:offsets[i + 1]]
+        self.member_books = array('i')
+        self.member_numbers = {}  # Email -> member number, for the members that are used
+        self.book_rows = book_rows
+
+        books = []
+        current = None
+        for member, book_id in pairs:
+            if member != current:
+                self.add_member(current, books)
+                current, books = member, []
+            if 0 < book_id < self.book_rows:
+                books.append(book_id)
+        self.add_member(current, books)
+
+        # Invert into book -> member numbers with a counting sort
+        self.book_counts = array('i', bytes(4 * self.book_rows))
+        for book_id in self.member_books:
+            self.book_counts[book_id] += 1
+        self.set_counts(self.book_counts)
+        self.book_offsets = array('q', accumulate(self.book_counts, initial=0))
+        self.book_members = array('i', bytes(4 * len(self.member_books)))
+        fill = array('q', self.book_offsets[:-1])
+        for number in range(len(self.member_offsets) - 1):
+            for book_id in self.member_books[self.member_offsets[number]:self.member_offsets[number + 1]]:
+                self.book_members[fill[book_id]] = number
+                fill[book_id] += 1
+
+    def set_counts(self, counts):
+        """Set the member count of every book that similarity scores are normalised by."""
+        self.inverse_norms = array('d', (count ** -0.5 if count else 0.0 for count in counts))
+
+    def add_member(self, member, books):
+        if member is None or not books or len(books) > MAX_MEMBER_BOOKS:
+            return
+        self.member_numbers[member] = len(self.member_offsets) - 1
+        self.member_books.extend(books)
+        self.member_offsets.append(len(self.member_books))
+
+    def books_of(self, number):
+        return self.member_books[self.member_offsets[number]:self.member_offsets[number + 1]]
+
+    def top_similar(self, book_id, k):
+        """The k books sharing the most members with book_id relative to their sizes, as (book ids, scores)."""
+        counts = Counter()
+        for number in self.book_members[self.book_offsets[book_id]:self.book_offsets[book_id + 1]]:
+            counts.update(self.books_of(number))
+        counts.pop(book_id, None)
+        # Rank by shared / sqrt(members of other); the constant 1 / sqrt(members of book_id) is applied to the top k
+        others = list(counts)
+        weighted = map(mul, counts.values(), map(self.inverse_norms.__getitem__, others))
+        top = heapq.nlargest(k, zip(weighted, others))
+        ids = array('i', [other for _, other in top] + [0] * (k - len(top)))
+        scores = array('f', [weight * self.inverse_norms[book_id] for weight, _ in top] + [0.0] * (k - len(top)))
+        return ids, scores
+
+
+def watermarks(cursor):
+    cursor.execute('SELECT IFNULL(MAX(bid), 0) FROM borrowings')
+    last_bid = cursor.fetchone()[0]
+    cursor.execute('SELECT IFNULL(MAX(rid), 0) FROM reviews')
+    return last_bid, cursor.fetchone()[0]
+
+
+def book_rows(cursor):
+    cursor.execute('SELECT IFNULL(MAX(book_id), 0) FROM books')
+    return cursor.fetchone()[0] + 1
+
+
+def write_file(path, k, rows, last_bid, last_rid, row_data, counts):
+    """Write a complete file next to 'path' and rename it over the old one."""
+    with open(path + '.tmp', 'wb') as output:
+        output.write(HEADER.pack(MAGIC, k, rows, last_bid, last_rid).ljust(HEADER_SIZE, b'\0'))
+        for chunk in row_data:
+            output.write(chunk)
+        output.write(counts.tobytes())
+    os.replace(path + '.tmp', path)
+
+
+def build(cursor, path, k=TOP_K):
+    """Compute every book's row and write a new file, replacing the old one at the end. Returns the row count."""
+    last_bid, last_rid = watermarks(cursor)  # Read first: pairs added during the build are picked up by refresh()
+    rows = book_rows(cursor)
+    cursor.execute(PAIRS_QUERY)
+    interactions = Interactions(cursor, rows)
+    empty_row = bytes(8 * k)
+
+    def row_data():
+        for start in range(0, rows, BATCH_BOOKS):
+            data = bytearray()
+            for book_id in range(start, min(start + BATCH_BOOKS, rows)):
+                if book_id and interactions.book_counts[book_id]:
+                    ids, scores = interactions.top_similar(book_id, k)
+                    data += ids.tobytes() + scores.tobytes()
+                else:
+                    data += empty_row
+            yield data
+
+    write_file(path, k, rows, last_bid, last_rid, row_data(), interactions.book_counts)
+    return rows
+
+
+def read_in_batches(cursor, query, values):
+    """Run a query with an IN list over 'values', BATCH_MEMBERS at a time, and yield its rows."""
+    values = list(values)
+    for start in range(0, len(values), BATCH_MEMBERS):
+        batch = values[start:start + BATCH_MEMBERS]
+        cursor.execute(query.format(', '.join('?' * len(batch))), batch * 3)  # The list appears in three selects
+        yield from cursor
+
+
+def refresh(cursor, path):
+    """
+    Recompute the rows affected by the borrowings and reviews added since the file was built or last refreshed and
+    write a new file with them. Falls back to a full build if there is no usable file. Returns the number of rows
+    recomputed.
+    """
+    try:
+        with open(path, 'rb') as existing:
+            magic, k, old_rows, last_bid, last_rid = HEADER.unpack(existing.read(HEADER_SIZE)[:HEADER.size])
+            if magic != MAGIC:
+                raise ValueError
+            row_size = 8 * k
+            old_data = existing.read(old_rows * row_size)
+            counts = array('i')
+            counts.frombytes(existing.read(4 * old_rows))
+        if len(old_data) != old_rows * row_size or len(counts) != old_rows:
+            raise ValueError
+    except (OSError, ValueError, struct.error):
+        return build(cursor, path)
+
+    new_last_bid, new_last_rid = watermarks(cursor)
+    rows = max(book_rows(cursor), old_rows)
+    cursor.execute('''
+    SELECT member FROM borrowings WHERE bid > ? AND bid <= ?
+    UNION SELECT member FROM reviews WHERE rid > ? AND rid <= ?
+    ''', (last_bid, new_last_bid, last_rid, new_last_rid))
+    new_members = [row[0] for row in cursor.fetchall()]
+
+    # The books whose rows change: every book of a member with new pairs, since that member's set of books changed
+    affected = {book_id for _, book_id in read_in_batches(cursor, MEMBER_PAIRS_QUERY, new_members)}
+    affected = sorted(book_id for book_id in affected if 0 < book_id < rows)
+    # Every member of those books with all of their pairs: enough to count what each affected book shares with any
+    # other, and the member count of each affected book
+    members = {row[0] for row in read_in_batches(cursor, BOOK_MEMBERS_QUERY, affected)}
+    pairs = sorted(read_in_batches(cursor, MEMBER_PAIRS_QUERY, members))
+    interactions = Interactions(pairs, rows)
+
+    # Member counts of the other books have not changed since they were written
+    counts.extend([0] * (rows - old_rows))
+    for book_id in affected:
+        counts[book_id] = interactions.book_counts[book_id]
+    interactions.set_counts(counts)
+
+    data = bytearray(old_data)
+    data += bytes((rows - old_rows) * row_size)
+    for book_id in affected:
+        if interactions.book_counts[book_id]:
+            ids, scores = interactions.top_similar(book_id, k)
+            data[book_id * row_size:(book_id + 1) * row_size] = ids.tobytes() + scores.tobytes()
+        else:
+            data[book_id * row_size:(book_id + 1) * row_size] = bytes(row_size)
+    write_file(path, k, rows, new_last_bid, new_last_rid, [data], counts)
+    return len(affected)
+
+
+class Recommendations:
+    """Read-only view of a recommendations file through mmap; lookups copy nothing but the requested row."""
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.k, self.book_rows, _, _ = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f'{path} is not a recommendations file')
+        self.book_rows = min(self.book_rows, (len(self.map) - HEADER_SIZE) // (8 * self.k))
+        self.view = memoryview(self.map)
+
+    def similar(self, book_id, limit=TOP_K):
+        """Return up to 'limit' (book_id, score) pairs for the books most often borrowed with book_id."""
+        if not 0 < book_id < self.book_rows:
+            return []
+        start = HEADER_SIZE + book_id * 8 * self.k
+        ids = self.view[start:start + 4 * self.k].cast('i')
+        scores = self.view[start + 4 * self.k:start + 8 * self.k].cast('f')
+        return [(ids[i], scores[i]) for i in range(min(limit, self.k)) if ids[i]]
+
+    def close(self):
+        if hasattr(self, 'view'):
+            self.view.release()
+        self.map.close()
+        self.file.close()
@@ -0,0 +1,51 @@
+-- Library database schema expected by miniproject.py.
+-- Create a new database with: sqlite3 library.db < schema.sql
+
+create table members (
+  email       char(100),
+  passwd      char(100),
+  name        char(255) not null,
+  byear       integer,
+  faculty     char(100),
+  primary key (email)
+);
+
+create table books (
+  book_id     integer,
+  title       char(255),
+  author      char(150),
+  pyear       integer,
+  primary key (book_id)
+);
+
+create table borrowings (
+  bid         integer,
+  member      char(100) not null,
+  book_id     integer not null,
+  start_date  date,
+  end_date    date,
+  primary key (bid),
+  foreign key (member) references members,
+  foreign key (book_id) references books
+);
+
+create table penalties (
+  pid         integer,
+  bid         integer not null,
+  amount      integer,
+  paid_amount integer,
+  primary key (pid),
+  foreign key (bid) references borrowings
+);
+
+create table reviews (
+  rid         integer,
+  book_id     integer not null,
+  member      char(100) not null,
+  rating      integer,
+  rtext       char(255),
+  rdate       date,
+  primary key (rid),
+  foreign key (member) references members,
+  foreign key (book_id) references books
+);
@@ -0,0 +1,85 @@
+"""
+Bounded cache of book search result pages, used by miniproject.search_books_page() when LIBRARY_SEARCH_CACHE=1.
+
+Pages are keyed by (keyword, cursor, page size), evicted least recently used first once the cache is full, and
+dropped after a time limit. A page shows the rating and availability of its books, so every borrow, return or
+review of a book removes exactly the cached pages that show that book; which books match a keyword and in what
+order never changes through those writes, so no other page is affected.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_MAX_PAGES = 10000
+DEFAULT_TTL_SECONDS = 300
+
+
+class SearchCache:
+    """LRU cache of search pages with per-book invalidation and hit, miss, eviction and invalidation counters."""
+
+    def __init__(self, max_pages=DEFAULT_MAX_PAGES, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.max_pages = max_pages
+        self.ttl_seconds = ttl_seconds
+        self.pages = OrderedDict()  # Key -> (expiry time, books, next cursor), least recently used first
+        self.keys_by_book = {}  # book_id -> keys of the cached pages showing that book
+        self.generation = 0  # Bumped by every invalidation, see put()
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = self.invalidations = 0
+
+    def get(self, key):
+        """Return (books, next cursor) for a cached page, or None."""
+        with self.lock:
+            entry = self.pages.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self.remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.pages.move_to_end(key)
+            self.hits += 1
+            return list(entry[1]), entry[2]
+
+    def put(self, key, books, next_cursor, generation):
+        """
+        Cache a page read from the database. 'generation' is the value of self.generation before the read: if a
+        write invalidated anything since, the page may predate that write and is not cached.
+        """
+        with self.lock:
+            if generation != self.generation:
+                return
+            if key in self.pages:
+                self.remove(key)
+            self.pages[key] = (time.monotonic() + self.ttl_seconds, tuple(books), next_cursor)
+            for book in books:
+                self.keys_by_book.setdefault(book[0], set()).add(key)
+            while len(self.pages) > self.max_pages:
+                self.remove(next(iter(self.pages)))
+                self.evictions += 1
+
+    def invalidate_book(self, book_id):
+        """Drop every cached page that shows the book; call after a write to it has committed."""
+        with self.lock:
+            self.generation += 1
+            for key in self.keys_by_book.pop(book_id, ()):
+                if key in self.pages:
+                    self.remove(key)
+                    self.invalidations += 1
+
+    def remove(self, key):
+        """Remove one page and its entries in keys_by_book. The caller holds the lock."""
+        _, books, _ = self.pages.pop(key)
+        for book in books:
+            keys = self.keys_by_book.get(book[0])
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.keys_by_book[book[0]]
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'pages': len(self.pages), 'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0, 'evictions': self.evictions,
+                    'expirations': self.expirations, 'invalidations': self.invalidations}
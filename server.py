@@ -0,0 +1,302 @@
+"""
+HTTP/JSON interface to the library operations, started with: python miniproject.py serve <dbname> [port]
+
+The server runs on asyncio so that many members can be connected at once. Each request's SQLite work is handed
+to a thread pool (sized to the connection pool) so that a slow query never blocks the event loop.
+
+Endpoints (all bodies and responses are JSON; every endpoint except /login needs "Authorization: Bearer <token>"; a
+token expires after LIBRARY_SESSION_IDLE_SECONDS (default 3600) without a request, and the least recently used
+sessions are dropped beyond MAX_SESSIONS; a body over MAX_BODY_BYTES is answered with 413 and the connection closed):
+    POST /login       {"email", "password"}                  -> {"token", "email"}
+    GET  /profile                                            -> member info, borrowing counts and debt
+    GET  /search?q=keyword[&after=cursor][&size=n]           -> {"books", "next"}; pass "next" back as 'after'
+                                                                with "suggestion" when nothing matched and the
+                                                                books are those of that corrected keyword ("next"
+                                                                then continues them, keeping q unchanged)
+    POST /borrow      {"book_id"}                            -> {"bid"}
+    POST /return      {"bid"[, "rating", "review"]}          -> {"overdue_days", "rid"}
+    GET  /penalties                                          -> {"penalties"}
+    GET  /related?book_id=n                                  -> {"books"}: books often borrowed with that one
+    POST /pay         {"pid", "amount"}                      -> {"total_debt"}
+"""
+import asyncio
+import base64
+import json
+import math
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import parse_qs, urlsplit
+
+import miniproject
+
+READERS = 8  # Reader connections in the pool; the thread pool gets one more thread for the writer
+MAX_PAGE_SIZE = 50
+MAX_BODY_BYTES = 64 * 1024  # Every request body is a small JSON object; a larger one is refused unread
+SQLITE_INT_RANGE = range(-2 ** 63, 2 ** 63)  # Integers SQLite can store; a larger one raises OverflowError
+REASONS = {200: 'OK', 400: 'Bad Request', 401: 'Unauthorized', 404: 'Not Found', 409: 'Conflict',
+           413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+SESSION_IDLE_SECONDS = float(os.environ.get('LIBRARY_SESSION_IDLE_SECONDS', 3600))
+MAX_SESSIONS = 100000
+
+sessions = OrderedDict()  # Session token -> (member email, expiry time), least recently used first
+sessions_lock = threading.Lock()
+
+
+class RequestError(Exception):
+    """Raised by a handler to answer with an error status and message."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def encode_cursor(keyword, after):
+    """
+    Turn a search page cursor into an opaque string for the client. It holds the keyword whose results it pages
+    through, which is the suggested one when the original keyword found nothing.
+    """
+    return base64.urlsafe_b64encode(json.dumps([keyword, *after]).encode()).decode() if after else None
+
+
+def decode_cursor(text):
+    """Turn a cursor string sent back by the client into its keyword and the tuple search_books_page() expects."""
+    try:
+        keyword, sort_order, sort_key, book_id = json.loads(base64.urlsafe_b64decode(text.encode()))
+        if int(sort_order) not in SQLITE_INT_RANGE or int(book_id) not in SQLITE_INT_RANGE:
+            raise ValueError
+        return str(keyword), (int(sort_order), str(sort_key), int(book_id))
+    except (ValueError, TypeError):
+        raise RequestError(400, 'invalid cursor')
+
+
+def login(email, body, query):
+    member_email = miniproject.find_member(str(body.get('email', '')), str(body.get('password', '')))
+    if not member_email:
+        raise RequestError(401, 'invalid email or password')
+    return {'token': start_session(member_email), 'email': member_email}
+
+
+def start_session(email):
+    """Create a session for a member and return its token, dropping expired and, past MAX_SESSIONS, oldest ones."""
+    token = secrets.token_hex(16)
+    now = time.monotonic()
+    with sessions_lock:
+        sessions[token] = (email, now + SESSION_IDLE_SECONDS)
+        # Every use moves a session to the end with a new expiry, so the expired ones are all at the front
+        while sessions and (len(sessions) > MAX_SESSIONS or next(iter(sessions.values()))[1] < now):
+            sessions.popitem(last=False)
+    return token
+
+
+def session_member(token):
+    """Return the email of a token's member and extend its session, or None if it is unknown or has expired."""
+    now = time.monotonic()
+    with sessions_lock:
+        email, expiry = sessions.get(token, (None, 0))
+        if expiry < now:
+            sessions.pop(token, None)
+            return None
+        sessions[token] = (email, now + SESSION_IDLE_SECONDS)
+        sessions.move_to_end(token)
+        return email
+
+
+def profile(email, body, query):
+    summary = miniproject.get_member_summary(email)
+    if not summary:
+        raise RequestError(404, 'member not found')
+    keys = ('name', 'email', 'byear', 'previous_borrowings', 'current_borrowings', 'overdue_borrowings',
+            'unpaid_penalties', 'total_debt')
+    return dict(zip(keys, summary))
+
+
+def search(email, body, query):
+    keyword = query.get('q', [''])[0].strip().lower()
+    if not keyword:
+        raise RequestError(400, 'missing keyword q')
+    # A cursor continues the results it was returned with, which may be those of a suggested keyword
+    searched, after = decode_cursor(query['after'][0]) if 'after' in query else (keyword, None)
+    try:
+        page_size = min(max(int(query.get('size', ['5'])[0]), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        raise RequestError(400, 'invalid page size')
+
+    books, next_cursor = miniproject.search_books_page(searched, after, page_size)
+    if not books and after is None:
+        # Probably misspelled: answer with the results of the corrected keyword, which the client pages through
+        suggestion = miniproject.suggest_keyword(keyword)
+        if suggestion:
+            searched = suggestion
+            books, next_cursor = miniproject.search_books_page(suggestion, None, page_size)
+    keys = ('book_id', 'title', 'author', 'pyear', 'avg_rating', 'status')
+    response = {'books': [dict(zip(keys, book)) for book in books], 'next': encode_cursor(searched, next_cursor)}
+    if searched != keyword:
+        response['suggestion'] = searched
+    return response
+
+
+def borrow(email, body, query):
+    bid = miniproject.borrow_book(email, int_field(body, 'book_id'))
+    if bid is None:
+        raise RequestError(409, 'book is on borrow or does not exist')
+    return {'bid': bid}
+
+
+def return_book(email, body, query):
+    bid = int_field(body, 'bid')
+    rating = body.get('rating')
+    if rating is not None and (not isinstance(rating, int) or isinstance(rating, bool) or not 1 <= rating <= 5):
+        raise RequestError(400, 'rating must be an integer between 1 and 5')
+
+    book_id = miniproject.find_open_borrowing(email, bid)
+    today = datetime.now().date()
+    overdue_days = miniproject.record_return(email, bid, today) if book_id else None
+    if overdue_days is None:
+        raise RequestError(409, 'no open borrowing with that id')
+
+    rid = None
+    if rating is not None:
+        rid = miniproject.add_review(email, book_id, rating, str(body.get('review', '')), today.strftime('%Y-%m-%d'))
+    return {'overdue_days': overdue_days, 'rid': rid}
+
+
+def related(email, body, query):
+    try:
+        book_id = int(query.get('book_id', [''])[0])
+    except ValueError:
+        raise RequestError(400, 'book_id must be an integer')
+    if book_id not in SQLITE_INT_RANGE:
+        raise RequestError(400, 'book_id is out of range')
+    keys = ('book_id', 'title', 'author')
+    return {'books': [dict(zip(keys, book)) for book in miniproject.get_related_books(book_id, 5)]}
+
+
+def penalties(email, body, query):
+    keys = ('pid', 'bid', 'amount', 'paid_amount')
+    return {'penalties': [dict(zip(keys, penalty)) for penalty in miniproject.get_unpaid_penalties(email)]}
+
+
+def pay(email, body, query):
+    amount = body.get('amount')
+    if not isinstance(amount, (int, float)) or isinstance(amount, bool) or not math.isfinite(amount) or amount <= 0:
+        raise RequestError(400, 'amount must be a positive number')
+    if not miniproject.record_payment(email, int_field(body, 'pid'), amount):
+        raise RequestError(409, 'no unpaid penalty with that id, or amount exceeds it')
+    return {'total_debt': miniproject.get_member_summary(email)[7]}
+
+
+def int_field(body, name):
+    value = body.get(name)
+    if not isinstance(value, int) or isinstance(value, bool):  # JSON true and false arrive as bool, an int subclass
+        raise RequestError(400, f'{name} must be an integer')
+    if value not in SQLITE_INT_RANGE:
+        raise RequestError(400, f'{name} is out of range')
+    return value
+
+
+# (method, path) -> (handler, whether a logged-in session is required)
+ROUTES = {
+    ('POST', '/login'): (login, False),
+    ('GET', '/profile'): (profile, True),
+    ('GET', '/search'): (search, True),
+    ('POST', '/borrow'): (borrow, True),
+    ('POST', '/return'): (return_book, True),
+    ('GET', '/related'): (related, True),
+    ('GET', '/penalties'): (penalties, True),
+    ('POST', '/pay'): (pay, True),
+}
+
+
+def dispatch(method, target, headers, body):
+    """Run the handler for one request (on a worker thread) and return (status, JSON-serialisable payload)."""
+    url = urlsplit(target)
+    route = ROUTES.get((method, url.path))
+    if not route:
+        return 404, {'error': 'unknown endpoint'}
+    handler, needs_session = route
+
+    try:
+        email = None
+        if needs_session:
+            token = headers.get('authorization', '').removeprefix('Bearer ').strip()
+            email = session_member(token)
+            if not email:
+                raise RequestError(401, 'log in first')
+        try:
+            payload = json.loads(body) if body else {}
+        except ValueError:
+            raise RequestError(400, 'body is not valid JSON')
+        if not isinstance(payload, dict):
+            raise RequestError(400, 'body must be a JSON object')
+        return 200, handler(email, payload, parse_qs(url.query))
+    except RequestError as error:
+        return error.status, {'error': str(error)}
+    except Exception as error:
+        return 500, {'error': f'{type(error).__name__}: {error}'}
+
+
+async def handle_connection(reader, writer, executor):
+    """Serve HTTP/1.1 requests on one client connection, keeping it open between requests."""
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            method, target, version = request_line.decode('latin-1').split()
+
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get('content-length', 0))
+            if length > MAX_BODY_BYTES:
+                # Answer without reading the body, then close: the rest of the stream is that body
+                status, payload, keep_alive = 413, {'error': f'body exceeds {MAX_BODY_BYTES} bytes'}, False
+            else:
+                body = await reader.readexactly(length) if length else b''
+                status, payload = await loop.run_in_executor(executor, dispatch, method, target, headers, body)
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+
+            data = json.dumps(payload).encode()
+            writer.write(f'HTTP/1.1 {status} {REASONS[status]}\r\n'
+                         f'Content-Type: application/json\r\n'
+                         f'Content-Length: {len(data)}\r\n'
+                         f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'.encode() + data)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+        pass  # Client went away or sent something that is not HTTP
+    finally:
+        writer.close()
+
+
+async def serve(db_path, host='127.0.0.1', port=8080):
+    miniproject.connect_to_database(db_path, READERS)
+    miniproject.start_word_index_build()  # Suggestions start once it is built, a few seconds on a large catalog
+    executor = ThreadPoolExecutor(max_workers=READERS + 1)
+    server = await asyncio.start_server(lambda r, w: handle_connection(r, w, executor), host, port)
+    print(f"Serving the library on http://{host}:{port}", flush=True)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        executor.shutdown()
+        miniproject.close_database()
+
+
+def main(db_path, port=8080):
+    try:
+        asyncio.run(serve(db_path, port=port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,179 @@
+"""
+Multi-process stress test for the borrow, return and review write paths of miniproject.py.
+
+Several worker processes borrow and return a handful of books as fast as they can, so that almost every borrow
+races with another session. The run fails if a book is ever lent to two members at once, if two writes were given
+the same borrowing or review id, or if a penalty or the book statistics went missing.
+
+Usage: python stress_test.py [processes] [operations per process]
+"""
+import multiprocessing
+import os
+import queue
+import random
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime
+
+import miniproject
+
+BOOKS = 5  # Few books so that concurrent borrows keep colliding
+MEMBERS = 20
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.sql')
+
+
+def create_database(db_path):
+    """Create an empty library database with a few members and books."""
+    connection = sqlite3.connect(db_path)
+    with open(SCHEMA_PATH) as schema:
+        connection.executescript(schema.read())
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.executemany('INSERT INTO members (email, passwd, name) VALUES (?, ?, ?)',
+                           [(f'member{i}@example.com', 'pwd', f'member {i}') for i in range(MEMBERS)])
+    connection.executemany('INSERT INTO books (book_id, title, author, pyear) VALUES (?, ?, ?, ?)',
+                           [(i, f'book {i}', f'author {i}', 2000) for i in range(1, BOOKS + 1)])
+    connection.commit()
+    connection.close()
+
+    # Create the indexes and triggers once, before the workers start
+    miniproject.connect_to_database(db_path)
+    miniproject.close_database()
+
+
+def worker(db_path, seed, operations, holders, lock, results):
+    """Randomly borrow, return (sometimes late) and review books, recording every id handed out."""
+    miniproject.connect_to_database(db_path, readers=1)
+    rng = random.Random(seed)
+    today = datetime.now().date()
+
+    open_loans = []  # (bid, book_id, email) of the loans this worker currently holds
+    bids, rids = [], []
+    late_returns = 0
+    violations = 0
+
+    for _ in range(operations):
+        if open_loans and rng.random() < 0.5:
+            bid, book_id, email = open_loans.pop(rng.randrange(len(open_loans)))
+            if rng.random() < 0.3:
+                # Backdate the loan so that returning it creates a penalty
+                with miniproject.pool.writer() as cursor, miniproject.immediate_transaction(cursor):
+                    cursor.execute("UPDATE borrowings SET start_date = date('now', '-30 days') WHERE bid = ?", (bid,))
+
+            # Release the book in the shared table before the return commits, so that the next borrower never
+            # finds it still marked as held
+            with lock:
+                holders[book_id] = 0
+            overdue_days = miniproject.record_return(email, bid, today)
+            if overdue_days is None:
+                violations += 1  # Our own open loan could not be returned
+            elif overdue_days > 0:
+                late_returns += 1
+
+            if rng.random() < 0.5:
+                rids.append(miniproject.add_review(email, book_id, rng.randint(1, 5), 'stress', str(today)))
+        else:
+            email = f'member{rng.randrange(MEMBERS)}@example.com'
+            book_id = rng.randint(1, BOOKS)
+            bid = miniproject.borrow_book(email, book_id)
+            if bid is not None:
+                with lock:
+                    if holders[book_id] != 0:
+                        violations += 1  # Someone else still holds this book: it was lent twice
+                    holders[book_id] = os.getpid()
+                bids.append(bid)
+                open_loans.append((bid, book_id, email))
+
+    miniproject.close_database()
+    results.put((bids, rids, late_returns, violations))
+
+
+def check_database(db_path, bids, rids, late_returns):
+    """Return a list of problems found in the database after the run."""
+    problems = []
+    miniproject.connect_to_database(db_path, readers=1)
+
+    if len(set(bids)) != len(bids):
+        problems.append(f'{len(bids) - len(set(bids))} duplicate borrowing ids were handed out')
+    if len(set(rids)) != len(rids):
+        problems.append(f'{len(rids) - len(set(rids))} duplicate review ids were handed out')
+
+    with miniproject.pool.reader() as cursor:
+        cursor.execute('SELECT COUNT(*) FROM borrowings')
+        if cursor.fetchone()[0] != len(bids):
+            problems.append('the number of borrowings does not match the successful borrows')
+        cursor.execute('SELECT COUNT(*) FROM reviews')
+        if cursor.fetchone()[0] != len(rids):
+            problems.append('the number of reviews does not match the submitted reviews')
+        cursor.execute('SELECT COUNT(*) FROM penalties')
+        if cursor.fetchone()[0] != late_returns:
+            problems.append('the number of penalties does not match the late returns')
+
+        cursor.execute('SELECT book_id FROM borrowings WHERE end_date IS NULL GROUP BY book_id HAVING COUNT(*) > 1')
+        lent_twice = [row[0] for row in cursor.fetchall()]
+        if lent_twice:
+            problems.append(f'books with more than one open borrowing: {lent_twice}')
+
+        mismatched = miniproject.verify_book_stats(cursor)
+        if mismatched:
+            problems.append(f'book_stats is out of date for books {mismatched}')
+
+    miniproject.close_database()
+    return problems
+
+
+def collect_results(workers, results):
+    """Wait for the result of every worker; returns None, stopping the others, as soon as one died without one."""
+    outcomes = []
+    while len(outcomes) < len(workers):
+        try:
+            outcomes.append(results.get(timeout=1))
+        except queue.Empty:
+            if any(process.exitcode not in (None, 0) for process in workers):
+                for process in workers:
+                    process.terminate()
+                return None
+    return outcomes
+
+
+def main():
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    operations = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'stress.db')
+        create_database(db_path)
+
+        holders = multiprocessing.Array('i', BOOKS + 1)  # Process currently holding each book, 0 if none
+        lock = multiprocessing.Lock()
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=worker, args=(db_path, seed, operations, holders, lock, results))
+                   for seed in range(processes)]
+        for process in workers:
+            process.start()
+        outcomes = collect_results(workers, results)
+        for process in workers:
+            process.join()
+        if outcomes is None:
+            print(f"FAIL: a worker process died: exit codes {[process.exitcode for process in workers]}")
+            sys.exit(1)
+
+        bids = [bid for outcome in outcomes for bid in outcome[0]]
+        rids = [rid for outcome in outcomes for rid in outcome[1]]
+        late_returns = sum(outcome[2] for outcome in outcomes)
+        violations = sum(outcome[3] for outcome in outcomes)
+
+        problems = check_database(db_path, bids, rids, late_returns)
+        if violations:
+            problems.append(f'{violations} double loans or failed returns were observed by the workers')
+
+    print(f"{processes} processes, {len(bids)} borrowings, {len(rids)} reviews, {late_returns} penalties")
+    if problems:
+        for problem in problems:
+            print(f"FAIL: {problem}")
+        sys.exit(1)
+    print("PASS: no double lending and no duplicate ids")
+
+
+if __name__ == '__main__':
+    main()
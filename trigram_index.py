@@ -0,0 +1,139 @@
+"""
+Trigram index over the distinct words of book titles and authors, used by miniproject.suggest_keyword() to correct
+misspelled search keywords.
+
+Similarity is the one of PostgreSQL's pg_trgm: a word is padded with two spaces in front and one behind, split into
+its distinct three-character trigrams, and two words score shared trigrams / distinct trigrams of both together.
+The index is over words rather than books, so a lookup costs the same whatever the size of the catalog; the
+corrected keyword is then searched for like any other.
+
+Words are numbered in order of their number of trigrams, so the posting list of a trigram (the numbers of the words
+containing it, an ascending int32 array) is cut to the words of one size with two bisects. Sizes are searched
+closest to the query's first, and between two sizes the similarity threshold fixes how many trigrams a match has
+to share; that lets the postings of the query's most common trigrams, which hold most of the entries, be skipped
+in the count and only used to check the words found in the others.
+
+Words added after the index was built are kept in a small side table and compared one by one until there are
+enough of them to make rebuilding worthwhile.
+"""
+import math
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from itertools import compress
+
+THRESHOLD = 0.3  # Lowest similarity worth suggesting, the default of pg_trgm
+REBUILD_FRACTION = 0.1  # Rebuild once the words added since the last build reach this share of the index
+COMMON_TRIGRAMS = 4  # Most common trigrams of a query that are looked up instead of counted, see similar()
+EMPTY = array('i')
+
+
+def trigrams(word):
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    """
+    Set of words that can be searched for the words most similar to a given one. Not thread-safe: add() and build()
+    must not run while another thread is in similar().
+    """
+
+    def __init__(self, words=()):
+        self.build(words)
+
+    def build(self, words):
+        word_trigrams = {word: trigrams(word) for word in set(words)}
+        self.words = sorted(word_trigrams, key=lambda word: (len(word_trigrams[word]), word))
+        self.numbers = {word: number for number, word in enumerate(self.words)}
+        self.postings = {}
+        for number, word in enumerate(self.words):
+            for trigram in word_trigrams[word]:
+                posting = self.postings.get(trigram)
+                if posting is None:
+                    posting = self.postings[trigram] = array('i')
+                posting.append(number)
+
+        # size_starts[m] is the number of the first word with at least m distinct trigrams
+        largest = len(word_trigrams[self.words[-1]]) if self.words else 0
+        self.size_starts = array('i', [0]) * (largest + 2)
+        number = 0
+        for size in range(1, largest + 2):
+            while number < len(self.words) and len(word_trigrams[self.words[number]]) < size:
+                number += 1
+            self.size_starts[size] = number
+        self.added = {}  # Word -> trigrams, for the words added since the build
+
+    def __contains__(self, word):
+        return word in self.numbers or word in self.added
+
+    def __len__(self):
+        return len(self.words) + len(self.added)
+
+    def add(self, words):
+        """Add words that are not in the index yet."""
+        for word in words:
+            if word not in self:
+                self.added[word] = trigrams(word)
+        if len(self.added) > REBUILD_FRACTION * len(self.words) + 1000:
+            self.build(self.words + list(self.added))
+
+    def size_start(self, size):
+        return self.size_starts[min(size, len(self.size_starts) - 1)]
+
+    def similar(self, word, limit=3, threshold=THRESHOLD):
+        """Return up to 'limit' (similarity, word) pairs for the most similar words, most similar first."""
+        query = trigrams(word)
+        size = len(query)
+        postings = [self.postings.get(trigram, EMPTY) for trigram in query]
+        matches = []
+
+        # Words with m distinct trigrams can only score 'threshold' if threshold * size <= m <= size / threshold.
+        # Sizes closest to the query's come first: once 'limit' matches are found, the weakest of them becomes the
+        # threshold, which rules out more sizes and raises the overlap needed in the others.
+        sizes = range(math.ceil(threshold * size), int(size / threshold) + 1)
+        for other_size in sorted(sizes, key=lambda other_size: abs(other_size - size)):
+            if len(matches) >= limit:
+                threshold = matches[limit - 1][0]
+            if not threshold * size <= other_size <= size / threshold:
+                continue
+            first, last = self.size_start(other_size), self.size_start(other_size + 1)
+            if first == last:
+                continue
+            slices = sorted((posting[bisect_left(posting, first):bisect_left(posting, last)] for posting in postings),
+                            key=len)
+
+            # Fewest shared trigrams for the threshold between the two sizes. A word sharing that many contains one
+            # of the size - need + 1 rarest trigrams, so only the postings of the few most common trigrams can be
+            # left out of the count: a word found in the others is then looked up in them.
+            need = math.ceil(threshold * (size + other_size) / (1 + threshold) - 1e-9)
+            index = min(max(size - need + 2, size - COMMON_TRIGRAMS), size)
+            counts = Counter()
+            for posting in slices[:index]:
+                counts.update(posting)
+            # Only words that can still get to 'need' with the postings left are kept, and dropped as soon as they
+            # no longer can
+            least = need - (size - index)
+            candidates = [(number, counts[number]) for number in compress(counts, map(least.__le__, counts.values()))]
+            for posting in slices[index:]:
+                index += 1
+                remaining = []
+                for number, shared in candidates:
+                    position = bisect_left(posting, number)
+                    if position < len(posting) and posting[position] == number:
+                        shared += 1
+                    if shared + size - index >= need:
+                        remaining.append((number, shared))
+                candidates = remaining
+
+            matches += [(shared / (size + other_size - shared), self.words[number]) for number, shared in candidates]
+            matches.sort(key=lambda match: (-match[0], match[1]))
+            del matches[limit:]
+
+        for other, other_trigrams in self.added.items():
+            common = len(query & other_trigrams)
+            score = common / (size + len(other_trigrams) - common)
+            if score >= threshold:
+                matches.append((score, other))
+        matches.sort(key=lambda match: (-match[0], match[1]))
+        return matches[:limit]
@@ -0,0 +1,108 @@
+"""
+Group commit for the write paths of miniproject.py, used when LIBRARY_GROUP_COMMIT=1.
+
+Instead of every borrow, return, review, payment or registration committing on its own, callers hand the write to
+a single writer thread and get a Future back. The thread runs whatever has queued up, at most MAX_BATCH writes,
+in one transaction with one commit, so concurrent sessions share the cost of syncing the commit to disk: the
+writes that arrive while one batch commits form the next batch. A batch can also be held open for a few
+milliseconds to gather more writes (LIBRARY_GROUP_COMMIT_WAIT_MS), which only pays off when syncing takes much
+longer than that; holding it open on a fast disk just adds the wait to every write. Each write runs inside its own savepoint: one that fails is rolled back on
+its own and its Future gets the exception, while the rest of the batch still commits.
+
+While the queue runs, the writer connection uses synchronous=FULL, so a commit is on disk when it returns and a
+Future only resolves once its write is durable.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+MAX_BATCH = 64  # Writes per transaction
+MAX_WAIT_MS = float(os.environ.get('LIBRARY_GROUP_COMMIT_WAIT_MS', 0))  # How long a batch waits for more writes
+
+
+class WriteQueue:
+    """Single writer thread committing the queued writes of all sessions in batches."""
+
+    def __init__(self, pool, transaction, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS):
+        """'transaction' is a context manager factory taking a cursor, such as miniproject.immediate_transaction."""
+        self.pool = pool
+        self.transaction = transaction
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.requests = queue.Queue()
+        self.batches = self.writes = 0
+
+        with pool.writer() as cursor:
+            cursor.execute('PRAGMA synchronous=FULL')
+        self.thread = threading.Thread(target=self.run, name='write-queue', daemon=True)
+        self.thread.start()
+
+    def submit(self, operation, *args):
+        """
+        Queue operation(cursor, *args) and return a Future for its result. The operation must not commit or roll
+        back; it runs inside the batch's transaction.
+        """
+        future = Future()
+        self.requests.put((future, operation, args))
+        return future
+
+    def run(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            batch = [request]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                try:
+                    request = self.requests.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if request is None:
+                    self.requests.put(None)  # Stop once this batch is committed
+                    break
+                batch.append(request)
+            self.commit(batch)
+
+    def commit(self, batch):
+        """Run a batch of writes in one transaction, then resolve their Futures."""
+        outcomes = []
+        try:
+            with self.pool.writer() as cursor, self.transaction(cursor):
+                for future, operation, args in batch:
+                    if not future.set_running_or_notify_cancel():
+                        outcomes.append(None)
+                        continue
+                    cursor.execute('SAVEPOINT queued_write')
+                    try:
+                        outcomes.append((True, operation(cursor, *args)))
+                    except Exception as error:
+                        cursor.execute('ROLLBACK TO queued_write')
+                        outcomes.append((False, error))
+                    cursor.execute('RELEASE queued_write')
+        except Exception as error:
+            # The transaction as a whole failed, so none of the writes happened
+            for future, _, _ in batch:
+                if future.running() or future.set_running_or_notify_cancel():
+                    future.set_exception(error)
+            return
+
+        self.batches += 1
+        self.writes += len(batch)
+        for (future, _, _), outcome in zip(batch, outcomes):
+            if outcome is None:
+                continue  # Cancelled before it ran
+            succeeded, value = outcome
+            if succeeded:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def close(self):
+        """Commit what is still queued, stop the thread and put the writer back to synchronous=NORMAL."""
+        self.requests.put(None)
+        self.thread.join()
+        with self.pool.writer() as cursor:
+            cursor.execute('PRAGMA synchronous=NORMAL')